@@ -10,7 +10,7 @@ class Arena():
     An Arena class where any 2 agents can be pit against each other.
     """
 
-    def __init__(self, player1, player2, game, display=None):
+    def __init__(self, player1, player2, game, display=None, repetitionLimit=0):
         """
         Input:
             player 1,2: two functions that takes board as input, return action
@@ -20,12 +20,18 @@ class Arena():
                      mode.
 
         see othello/OthelloPlayers.py for an example. See pit.py for pitting
-        human players/other baselines with each other.
+        human players/other baselines with each other. Players with a
+        getStats(reset) method, e.g. one returning MCTS.getStats of a search
+        built with args.mctsStats, have their stats logged after every game.
+
+        With repetitionLimit > 0, a game is drawn once the same position (see
+        Game.getRepetitionKey) has occurred that many times.
         """
         self.player1 = player1
         self.player2 = player2
         self.game = game
         self.display = display
+        self.repetitionLimit = repetitionLimit
 
     def playGame(self, verbose=False):
         """
@@ -41,6 +47,9 @@ class Arena():
         curPlayer = 1
         board = self.game.getInitBoard()
         it = 0
+        repetitions = {}  # repetition key of every position played -> #occurrences
+        if self.repetitionLimit:
+            self.isRepeated(board, curPlayer, repetitions)
 
         for player in players[0], players[2]:
             if hasattr(player, "startGame"):
@@ -68,15 +77,40 @@ class Arena():
 
             board, curPlayer = self.game.getNextState(board, curPlayer, action)
 
+            # a move that ends the game counts even if it also repeats a position
+            if (self.repetitionLimit and self.game.getGameEnded(board, curPlayer) == 0
+                    and self.isRepeated(board, curPlayer, repetitions)):
+                log.debug(f'Position repeated {self.repetitionLimit} times, the game is drawn')
+                result = 1e-4
+                break
+        else:
+            result = curPlayer * self.game.getGameEnded(board, curPlayer)
+
         for player in players[0], players[2]:
             if hasattr(player, "endGame"):
                 player.endGame()
+            if hasattr(player, "getStats"):
+                stats = player.getStats(reset=True)
+                log.debug(f'Search stats of {player}: {stats}')
 
         if verbose:
             assert self.display
-            print("Game over: Turn ", str(it), "Result ", str(self.game.getGameEnded(board, 1)))
+            print("Game over: Turn ", str(it), "Result ", str(result))
             self.display(board)
-        return curPlayer * self.game.getGameEnded(board, curPlayer)
+        return result
+
+    def isRepeated(self, board, curPlayer, repetitions):
+        """
+        Counts an occurrence of the position of board, curPlayer to move, in
+        repetitions.
+
+        Returns:
+            repeated: True if the position has now occurred repetitionLimit
+                      times
+        """
+        key = self.game.getRepetitionKey(self.game.getCanonicalForm(board, curPlayer))
+        repetitions[key] = repetitions.get(key, 0) + 1
+        return repetitions[key] >= self.repetitionLimit
 
     def playGames(self, num, verbose=False):
         """
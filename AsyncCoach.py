@@ -0,0 +1,225 @@
+import logging
+import multiprocessing
+import os
+import queue
+from collections import deque
+
+import numpy as np
+from tqdm import tqdm
+
+from Arena import Arena
+from Coach import Coach
+from ExampleStore import ShardDataset
+from MCTS import MCTS
+
+log = logging.getLogger(__name__)
+
+
+def readBestVersion(folder):
+    """
+    Returns:
+        version: the version of the best network so far, the iteration whose
+                 checkpoint (Coach.getCheckpointFile) self-play should use
+    """
+    with open(os.path.join(folder, 'best.version')) as f:
+        return int(f.read())
+
+
+def writeBestVersion(folder, version):
+    """
+    Makes version the best network. The file is replaced atomically, so the
+    self-play workers never read a partly written one.
+    """
+    path = os.path.join(folder, 'best.version')
+    with open(path + '.tmp', 'w') as f:
+        f.write(str(version))
+    os.replace(path + '.tmp', path)
+
+
+def runSelfPlayWorker(game, nnetClass, args, seed, episodes, stop):
+    """
+    Body of a self-play process: plays episodes with the best network until
+    stop is set, loading a new checkpoint whenever the best version changes.
+    Every episode is put on episodes as (version, trainExamples, resignStats),
+    waiting while the queue is full.
+    """
+    np.random.seed(seed)
+    episodes.cancel_join_thread()  # don't wait for the trainer to read the last episode when stopping
+    coach = Coach(game, nnetClass(game), args)
+    version = None
+    while not stop.is_set():
+        best = readBestVersion(args.checkpoint)
+        if best != version:
+            coach.nnet.load_checkpoint(args.checkpoint, coach.getCheckpointFile(best))
+            if coach.evalCache is not None:
+                coach.evalCache.invalidate()
+            version = best
+        coach.mcts = MCTS(game, coach.nnet, args, coach.evalCache)  # reset search tree
+        trainExamples = coach.executeEpisode()
+        resignStats, coach.resignStats = coach.resignStats, dict.fromkeys(coach.resignStats, 0)
+        while not stop.is_set():
+            try:
+                episodes.put((version, trainExamples, resignStats), timeout=1)
+                break
+            except queue.Full:
+                pass
+
+
+def runGater(game, nnetClass, args, candidates, results):
+    """
+    Body of the gating process: pits every candidate version received on
+    candidates against the best network, until it receives None. A candidate
+    that wins >= updateThreshold of the decided games becomes the best one,
+    it is saved as best.pth.tar and its version written to best.version.
+    When several candidates are pending, only the newest one is played.
+    Every decision is put on results as (version, pwins, nwins, draws,
+    accepted).
+    """
+    folder = args.checkpoint
+    best, candidate = nnetClass(game), nnetClass(game)
+    best.load_checkpoint(folder, Coach.getCheckpointFile(readBestVersion(folder)))
+    done = False
+    while not done:
+        pending = [candidates.get()]
+        while True:
+            try:
+                pending.append(candidates.get_nowait())
+            except queue.Empty:
+                break
+        done = None in pending
+        versions = [version for version in pending if version is not None]
+        if not versions:
+            continue
+        version = versions[-1]
+        if len(versions) > 1:
+            log.info(f'Skipping stale candidates {versions[:-1]}')
+
+        candidate.load_checkpoint(folder, Coach.getCheckpointFile(version))
+        pmcts = MCTS(game, best, args)
+        nmcts = MCTS(game, candidate, args)
+        arena = Arena(lambda x: np.argmax(pmcts.getActionProb(x, temp=0)),
+                      lambda x: np.argmax(nmcts.getActionProb(x, temp=0)), game,
+                      repetitionLimit=args.get('repetitionLimit', 0))
+        pwins, nwins, draws = arena.playGames(args.arenaCompare)
+        accepted = pwins + nwins > 0 and float(nwins) / (pwins + nwins) >= args.updateThreshold
+        if accepted:
+            candidate.save_checkpoint(folder=folder, filename='best.pth.tar')
+            writeBestVersion(folder, version)
+            best, candidate = candidate, best
+        results.put((version, pwins, nwins, draws, accepted))
+
+
+class AsyncCoach(Coach):
+    """
+    Runs self-play, training and gating at the same time, selected by setting
+    args.asyncPipeline.
+
+    args.numSelfPlayWorkers processes keep playing episodes with the best
+    network, while this process trains on the examples they send and a gating
+    process pits every trained network against the best one (see runGater).
+    Networks are handed over through versioned checkpoints: iteration i saves
+    its trained network to getCheckpointFile(i), and best.version holds the
+    iteration of the best network, which the workers load as soon as it
+    changes.
+
+    Unlike Coach, a rejected network is not thrown away: training goes on from
+    it and only self-play keeps the best network. Examples are thus a little
+    stale, played by the best version at the time. At most numEps episodes
+    wait in the queue while the network trains, so self-play lags at most
+    about one iteration behind.
+
+    A run in a checkpoint folder that already has a best.version resumes from
+    that best network, numbering its iterations after it.
+    """
+
+    def learn(self):
+        """
+        Performs numIters iterations: waits for numEps new episodes of
+        self-play, trains the neural network on the examples of the last
+        numItersForTrainExamplesHistory iterations, saves it and hands it
+        over to the gating process without waiting for its decision.
+        """
+        folder = self.args.checkpoint
+        os.makedirs(folder, exist_ok=True)
+        if os.path.isfile(os.path.join(folder, 'best.version')):
+            start = readBestVersion(folder)
+            log.info(f'Resuming from the best version {start}')
+        else:
+            start = 0
+            self.nnet.save_checkpoint(folder=folder, filename=self.getCheckpointFile(0))
+            writeBestVersion(folder, 0)
+
+        episodes = multiprocessing.Queue(maxsize=self.args.numEps)
+        candidates, results = multiprocessing.Queue(), multiprocessing.Queue()
+        stop = multiprocessing.Event()
+        gater = multiprocessing.Process(target=runGater, daemon=True,
+                                        args=(self.game, self.nnet.__class__, self.args, candidates, results))
+        gater.start()
+        workers = []
+        for seed in np.random.randint(2 ** 31, size=max(1, self.args.get('numSelfPlayWorkers', 1))):
+            worker = multiprocessing.Process(target=runSelfPlayWorker, daemon=True,
+                                             args=(self.game, self.nnet.__class__, self.args, seed, episodes, stop))
+            worker.start()
+            workers.append(worker)
+
+        try:
+            for i in range(start + 1, start + self.args.numIters + 1):
+                log.info(f'Starting Iter #{i} ...')
+                if not self.skipFirstSelfPlay or i > start + 1:
+                    iterationTrainExamples = deque([], maxlen=self.args.maxlenOfQueue)
+                    lag = 0
+                    for _ in tqdm(range(self.args.numEps), desc="Self Play"):
+                        version, examples, resignStats = self.getEpisode(episodes, workers + [gater])
+                        iterationTrainExamples += examples
+                        self.addResignStats(resignStats)
+                        lag += i - 1 - version
+                        self.logGateResults(results)
+                    log.info(f'SELF-PLAY VERSIONS LAG {lag / self.args.numEps:.1f} ITERATIONS BEHIND ON AVERAGE')
+                    self.logResignStats()
+                    self.replayBuffer.add(iterationTrainExamples, i)
+                    self.saveTrainExamples(i)
+
+                trainExamples = self.getTrainExamples()
+                self.nnet.train(trainExamples)
+                if isinstance(trainExamples, ShardDataset):
+                    trainExamples.close()
+                self.nnet.save_checkpoint(folder=folder, filename=self.getCheckpointFile(i))
+                candidates.put(i)
+        finally:
+            candidates.put(None)
+            gater.join()
+            self.logGateResults(results)
+            stop.set()
+            for worker in workers:
+                worker.join()
+
+    def getEpisode(self, episodes, processes):
+        """
+        Waits for the next episode on episodes.
+
+        Returns:
+            episode: (version, trainExamples, resignStats), see runSelfPlayWorker
+
+        Raises:
+            RuntimeError: if one of the self-play or gating processes died
+        """
+        while True:
+            try:
+                return episodes.get(timeout=1)
+            except queue.Empty:
+                dead = [process for process in processes if not process.is_alive()]
+                if dead:
+                    raise RuntimeError(f'Self-play stopped, processes {[p.name for p in dead]} exited with codes '
+                                       f'{[p.exitcode for p in dead]}')
+
+    def logGateResults(self, results):
+        """
+        Logs the decisions of the gating process received so far.
+        """
+        while True:
+            try:
+                version, pwins, nwins, draws, accepted = results.get_nowait()
+            except queue.Empty:
+                return
+            log.info(f'VERSION {version} NEW/PREV WINS : {nwins} / {pwins} ; DRAWS : {draws}')
+            log.info(('ACCEPTING' if accepted else 'REJECTING') + f' VERSION {version}')
@@ -0,0 +1,84 @@
+import threading
+
+
+class BatchingNet():
+    """
+    Stands in for a neural network shared by numClients threads, each running
+    its own MCTS (see Coach.executeEpisodes). Every call to predict or
+    predict_batch blocks until all the clients still playing have a pending
+    evaluation, then all of them are run through a single
+    nnet.predict_batch call and the results are handed back. The searches
+    thus advance in lock-step and every forward pass carries one board per
+    game instead of one.
+
+    A client that stops evaluating boards must call leave, or the others
+    would wait for it forever.
+    """
+
+    def __init__(self, nnet, numClients):
+        self.nnet = nnet
+        self.active = numClients  # #clients that may still send evaluations
+        self.pending = []  # (boards, result) of every waiting client
+        self.cond = threading.Condition()
+        self.batches = 0  # #forward passes run
+        self.boards = 0  # #boards evaluated
+
+    def __getattr__(self, name):
+        return getattr(self.nnet, name)
+
+    def predict(self, board):
+        pis, vs = self.evaluate([board])
+        return pis[0], vs[0]
+
+    def predict_batch(self, boards):
+        return self.evaluate(list(boards))
+
+    def evaluate(self, boards):
+        """
+        Queues boards for the next forward pass and waits for it.
+
+        Returns:
+            pis, vs: the policy and value of every board
+        """
+        result = {}
+        with self.cond:
+            self.pending.append((boards, result))
+            self.flushIfReady()
+            while not result:
+                self.cond.wait()
+        if 'error' in result:
+            raise RuntimeError('The batched evaluation failed in another thread') from result['error']
+        return result['pis'], result['vs']
+
+    def leave(self):
+        """
+        Tells the batcher that one client will not send evaluations anymore.
+        """
+        with self.cond:
+            self.active -= 1
+            self.flushIfReady()
+
+    def flushIfReady(self):
+        """
+        Evaluates all pending boards once every active client is waiting, the
+        lock must be held.
+        """
+        if not self.pending or len(self.pending) < self.active:
+            return
+        pending, self.pending = self.pending, []
+        boards = [board for boards, _ in pending for board in boards]
+        try:
+            pis, vs = self.nnet.predict_batch(boards)
+        except Exception as e:
+            for _, result in pending:
+                result['error'] = e
+            self.cond.notify_all()
+            raise
+        self.batches += 1
+        self.boards += len(boards)
+        i = 0
+        for boards, result in pending:
+            result['pis'] = pis[i:i + len(boards)]
+            result['vs'] = vs[i:i + len(boards)]
+            i += len(boards)
+        self.cond.notify_all()
@@ -1,18 +1,54 @@
 import logging
+import multiprocessing
 import os
 import sys
+import threading
 from collections import deque
-from pickle import Pickler, Unpickler
-from random import shuffle
+from pickle import Unpickler
 
 import numpy as np
 from tqdm import tqdm
 
 from Arena import Arena
+from BatchingNet import BatchingNet
+from EvalCache import EvalCache
+from ExampleStore import ExampleStore, ShardDataset
 from MCTS import MCTS
+from ReplayBuffer import ReplayBuffer
 
 log = logging.getLogger(__name__)
 
+selfPlayWorker = None  # the Coach of a self-play worker process, see initSelfPlayWorker
+
+
+def initSelfPlayWorker(game, nnetClass, args, checkpoint, seeds):
+    """
+    Initializer of the processes of Coach.executeEpisodesInPool: seeds the
+    random generator with a seed of its own, taken from the seeds queue, and
+    loads the network of the iteration from checkpoint, a (folder, filename)
+    tuple.
+    """
+    global selfPlayWorker
+    np.random.seed(seeds.get())
+    nnet = nnetClass(game)
+    nnet.load_checkpoint(*checkpoint)
+    selfPlayWorker = Coach(game, nnet, args)
+
+
+def playSelfPlayEpisode(_):
+    """
+    Plays one episode of self-play in a worker process.
+
+    Returns:
+        trainExamples: the examples of the episode, see Coach.executeEpisode
+        resignStats: the resignation counters of the episode
+    """
+    coach = selfPlayWorker
+    coach.mcts = MCTS(coach.game, coach.nnet, coach.args, coach.evalCache)  # reset search tree
+    trainExamples = coach.executeEpisode()
+    resignStats, coach.resignStats = coach.resignStats, dict.fromkeys(coach.resignStats, 0)
+    return trainExamples, resignStats
+
 
 class Coach():
     """
@@ -23,15 +59,24 @@ class Coach():
     def __init__(self, game, nnet, args):
         self.game = game
         self.nnet = nnet
-        self.pnet = self.nnet.__class__(self.game)  # the competitor network
+        self.pnet = None  # the competitor network, built by learn (self-play workers never need it)
         self.args = args
-        self.mcts = MCTS(self.game, self.nnet, self.args)
-        self.trainExamplesHistory = []  # history of examples from args.numItersForTrainExamplesHistory latest iterations
+        # evaluations of self.nnet shared by the searches of an iteration
+        self.evalCache = EvalCache(args.evalCacheSize) if args.get('evalCacheSize', 0) else None
+        self.mcts = MCTS(self.game, self.nnet, self.args, self.evalCache)
+        # examples of the args.numItersForTrainExamplesHistory latest iterations, by default room for all of them
+        # plus the iteration added before getTrainExamples drops the oldest one
+        maxSize = args.get('replayBufferSize', 0) or \
+            (args.get('numItersForTrainExamplesHistory', 20) + 1) * args.get('maxlenOfQueue', 200000)
+        self.replayBuffer = ReplayBuffer(maxSize)
         self.skipFirstSelfPlay = False  # can be overriden in loadTrainExamples()
+        self.lock = threading.Lock()  # guards the statistics below, episodes may run in parallel
+        self.resignStats = dict.fromkeys(('resigned', 'checked', 'falseResigns', 'pliesAfterResign'), 0)
 
-    def executeEpisode(self):
+    def executeEpisode(self, mcts=None):
         """
-        This function executes one episode of self-play, starting with player 1.
+        This function executes one episode of self-play, starting with player 1,
+        searching with mcts (self.mcts by default).
         As the game is played, each turn is added as a training example to
         trainExamples. The game is played till the game ends. After the game
         ends, the outcome of the game is used to assign values to each example
@@ -40,34 +85,218 @@ class Coach():
         It uses a temp=1 if episodeStep < tempThreshold, and thereafter
         uses temp=0.
 
+        With args.playoutCapFraction < 1 (playout cap randomization), only
+        that fraction of the moves, picked at random, is searched with
+        numMCTSSims simulations and added to trainExamples. The other moves
+        are played after a search of args.numMCTSSimsFast simulations.
+
+        A player resigns, and loses, once the value of the root of its search
+        has been below args.resignThreshold for args.resignMoves of its
+        consecutive moves. A fraction args.noResignFraction of the games is
+        played to the end regardless, to measure how often a resignation would
+        have been wrong (see logResignStats).
+
+        With args.repetitionLimit > 0, the game is adjudicated a draw once the
+        same position (see Game.getRepetitionKey) has occurred that many
+        times, instead of playing on until the game ends it.
+
         Returns:
             trainExamples: a list of examples of the form (canonicalBoard, currPlayer, pi,v)
                            pi is the MCTS informed policy vector, v is +1 if
                            the player eventually won the game, else -1.
         """
+        if mcts is None:
+            mcts = self.mcts
+        fullFraction = self.args.get('playoutCapFraction', 1)
+        resignThreshold = self.args.get('resignThreshold', -1)
+        canResign = np.random.random() >= self.args.get('noResignFraction', 0)
+        lowValueMoves = {1: 0, -1: 0}  # #consecutive moves of each player with a root value below resignThreshold
+        resignation = None  # (player, episodeStep) of the first time a player could resign
         trainExamples = []
+        repetitionLimit = self.args.get('repetitionLimit', 0)
+        repetitions = {}  # repetition key of every position played -> #occurrences
         board = self.game.getInitBoard()
-        self.curPlayer = 1
+        curPlayer = 1
         episodeStep = 0
 
         while True:
             episodeStep += 1
-            canonicalBoard = self.game.getCanonicalForm(board, self.curPlayer)
+            canonicalBoard = self.game.getCanonicalForm(board, curPlayer)
             temp = int(episodeStep < self.args.tempThreshold)
+            if repetitionLimit:
+                key = self.game.getRepetitionKey(canonicalBoard)
+                repetitions[key] = repetitions.get(key, 0) + 1
 
-            pi = self.mcts.getActionProb(canonicalBoard, temp=temp)
-            sym = self.game.getSymmetries(canonicalBoard, pi)
-            for b, p in sym:
-                trainExamples.append([b, self.curPlayer, p, None])
+            if fullFraction < 1 and np.random.random() >= fullFraction:
+                # a cheap search, the move is played but not learned from
+                pi = mcts.getActionProb(canonicalBoard, temp=temp, numSims=self.args.numMCTSSimsFast)
+            else:
+                pi = mcts.getActionProb(canonicalBoard, temp=temp)
+                sym = self.game.getSymmetries(canonicalBoard, pi)
+                for b, p in sym:
+                    trainExamples.append([b, curPlayer, p, None])
+
+            value = mcts.lastSearch['value']
+            if resignThreshold > -1 and value is not None:
+                lowValueMoves[curPlayer] = lowValueMoves[curPlayer] + 1 if value < resignThreshold else 0
+                if resignation is None and lowValueMoves[curPlayer] >= self.args.resignMoves:
+                    resignation = (curPlayer, episodeStep)
+                    if canResign:
+                        with self.lock:
+                            self.resignStats['resigned'] += 1
+                        return [(x[0], x[2], -1 if x[1] == curPlayer else 1) for x in trainExamples]
 
             action = np.random.choice(len(pi), p=pi)
-            board, self.curPlayer = self.game.getNextState(board, self.curPlayer, action)
+            board, curPlayer = self.game.getNextState(board, curPlayer, action)
 
-            r = self.game.getGameEnded(board, self.curPlayer)
+            r = self.game.getGameEnded(board, curPlayer)
+            if r == 0 and repetitionLimit:
+                key = self.game.getRepetitionKey(self.game.getCanonicalForm(board, curPlayer))
+                if repetitions.get(key, 0) + 1 >= repetitionLimit:
+                    r = 1e-4  # the position recurs once more, a draw
 
             if r != 0:
                 print(f"Reward: {r}")
-                return [(x[0], x[2], r * ((-1) ** (x[1] != self.curPlayer))) for x in trainExamples]
+                log.debug(f'Forced moves saved {mcts.forcedNodes} network calls and '
+                          f'{mcts.skippedSims} simulations')
+                if mcts.stats is not None:
+                    log.debug(f'Self-play search stats: {mcts.stats.toJSON()}')
+                if resignation is not None:
+                    # a game played to the end although a player could have resigned
+                    player, step = resignation
+                    with self.lock:
+                        self.resignStats['checked'] += 1
+                        self.resignStats['falseResigns'] += int(r * (1 if player == curPlayer else -1) > -0.5)
+                        self.resignStats['pliesAfterResign'] += episodeStep - step
+                return [(x[0], x[2], r * ((-1) ** (x[1] != curPlayer))) for x in trainExamples]
+
+    def logResignStats(self):
+        """
+        Logs the resignations of the self-play games since the last call: how
+        many games were resigned, how many of the games played to the end
+        would have been resigned wrongly, and the plies saved, estimated from
+        the plies those games lasted after the resignation point.
+        """
+        with self.lock:
+            stats, self.resignStats = self.resignStats, dict.fromkeys(self.resignStats, 0)
+        if not stats['resigned'] and not stats['checked']:
+            return
+        falseRate = stats['falseResigns'] / stats['checked'] if stats['checked'] else float('nan')
+        plies = stats['pliesAfterResign'] / stats['checked'] if stats['checked'] else float('nan')
+        log.info(f'RESIGNED {stats["resigned"]} GAMES ; FALSE RESIGNATIONS {stats["falseResigns"]}/{stats["checked"]} '
+                 f'({falseRate:.1%}) ; ~{stats["resigned"] * plies:.0f} PLIES SAVED')
+
+    def executeEpisodes(self, numEps):
+        """
+        Executes numEps episodes of self-play, args.numParallelGames of them at
+        a time. Each game runs in its own thread with its own MCTS, and the
+        network evaluations of all the games are batched into a single
+        predict_batch call per simulation step (see BatchingNet).
+
+        Returns:
+            trainExamples: the examples of all episodes, in the format of
+                           executeEpisode
+        """
+        numGames = min(self.args.numParallelGames, numEps)
+        nnet = BatchingNet(self.nnet, numGames)
+        lock = threading.Lock()
+        remaining = [numEps]
+        episodes, errors = [], []
+        progress = tqdm(total=numEps, desc="Self Play")
+
+        def play():
+            try:
+                while True:
+                    with lock:
+                        if remaining[0] == 0:
+                            return
+                        remaining[0] -= 1
+                    mcts = MCTS(self.game, nnet, self.args, self.evalCache)
+                    examples = self.executeEpisode(mcts)
+                    with lock:
+                        episodes.append(examples)
+                        progress.update()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                nnet.leave()
+
+        threads = [threading.Thread(target=play) for _ in range(numGames)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        progress.close()
+        if errors:
+            raise errors[0]
+        log.debug(f'Self-play evaluated {nnet.boards} boards in {nnet.batches} batches')
+        return [example for examples in episodes for example in examples]
+
+    def executeEpisodesInPool(self, numEps):
+        """
+        Executes numEps episodes of self-play in a pool of
+        args.numSelfPlayWorkers processes. The current network is saved to a
+        checkpoint that every worker loads once, when it starts, and the
+        examples of each episode are sent back as soon as it ends.
+
+        Returns:
+            trainExamples: the examples of all episodes, in the format of
+                           executeEpisode
+        """
+        checkpoint = (self.args.checkpoint, 'selfplay.pth.tar')
+        self.nnet.save_checkpoint(*checkpoint)
+        numWorkers = min(self.args.numSelfPlayWorkers, numEps)
+        seeds = multiprocessing.Queue()
+        for seed in np.random.randint(2 ** 31, size=numWorkers):
+            seeds.put(int(seed))
+
+        trainExamples = []
+        with multiprocessing.Pool(numWorkers, initSelfPlayWorker,
+                                  (self.game, self.nnet.__class__, self.args, checkpoint, seeds)) as pool:
+            episodes = pool.imap_unordered(playSelfPlayEpisode, range(numEps))
+            for examples, resignStats in tqdm(episodes, total=numEps, desc="Self Play"):
+                trainExamples += examples
+                self.addResignStats(resignStats)
+        return trainExamples
+
+    def addResignStats(self, resignStats):
+        """
+        Adds the resignation counters of episodes played in another process.
+        """
+        with self.lock:
+            for key, n in resignStats.items():
+                self.resignStats[key] += n
+
+    def getTrainExamples(self):
+        """
+        Drops the examples of the oldest iterations of the replay buffer beyond
+        args.numItersForTrainExamplesHistory.
+
+        With args.streamTrainExamples set, the examples are read from the
+        shards written by saveTrainExamples instead, batch by batch, and the
+        replay buffer is emptied. args.prefetchBatches batches are then read
+        ahead by a background thread (see ShardDataset).
+
+        Returns:
+            trainExamples: the replay buffer or the ShardDataset, from which
+                           the network samples its training batches
+
+        Raises:
+            RuntimeError: if there are no shards to stream, e.g. when resuming
+                          from a load_folder_file without examples
+        """
+        if self.args.get('streamTrainExamples', False):
+            while self.replayBuffer.getIterations():
+                self.replayBuffer.dropOldestIteration()
+            store = ExampleStore(os.path.join(self.args.checkpoint, 'examples'))
+            if not len(store):
+                raise RuntimeError(f'No trainExamples to stream in {store.folder}')
+            return ShardDataset(store, prefetch=self.args.get('prefetchBatches', 0))
+        while len(self.replayBuffer.getIterations()) > self.args.numItersForTrainExamplesHistory:
+            log.warning(f"Removing the oldest iteration in trainExamples. "
+                        f"Iterations in the replay buffer = {self.replayBuffer.getIterations()}")
+            self.replayBuffer.dropOldestIteration()
+        return self.replayBuffer
 
     def learn(self):
         """
@@ -78,6 +307,9 @@ class Coach():
         only if it wins >= updateThreshold fraction of games.
         """
 
+        if self.pnet is None:
+            self.pnet = self.nnet.__class__(self.game)
+
         for i in range(1, self.args.numIters + 1):
             # bookkeeping
             log.info(f'Starting Iter #{i} ...')
@@ -85,26 +317,23 @@ class Coach():
             if not self.skipFirstSelfPlay or i > 1:
                 iterationTrainExamples = deque([], maxlen=self.args.maxlenOfQueue)
 
-                for _ in tqdm(range(self.args.numEps), desc="Self Play"):
-                    self.mcts = MCTS(self.game, self.nnet, self.args)  # reset search tree
-                    iterationTrainExamples += self.executeEpisode()
+                if self.args.get('numSelfPlayWorkers', 1) > 1:
+                    iterationTrainExamples += self.executeEpisodesInPool(self.args.numEps)
+                elif self.args.get('numParallelGames', 1) > 1:
+                    iterationTrainExamples += self.executeEpisodes(self.args.numEps)
+                else:
+                    for _ in tqdm(range(self.args.numEps), desc="Self Play"):
+                        self.mcts = MCTS(self.game, self.nnet, self.args, self.evalCache)  # reset search tree
+                        iterationTrainExamples += self.executeEpisode()
+                if self.evalCache is not None:
+                    log.info(f'EVAL CACHE: {self.evalCache.getStats(reset=True)}')
+                self.logResignStats()
 
-                # save the iteration examples to the history 
-                self.trainExamplesHistory.append(iterationTrainExamples)
+                # save the iteration examples to the history and back them up to disk
+                self.replayBuffer.add(iterationTrainExamples, i)
+                self.saveTrainExamples(i)
 
-            if len(self.trainExamplesHistory) > self.args.numItersForTrainExamplesHistory:
-                log.warning(
-                    f"Removing the oldest entry in trainExamples. len(trainExamplesHistory) = {len(self.trainExamplesHistory)}")
-                self.trainExamplesHistory.pop(0)
-            # backup history to a file
-            # NB! the examples were collected using the model from the previous iteration, so (i-1)  
-            self.saveTrainExamples(i - 1)
-
-            # shuffle examples before training
-            trainExamples = []
-            for e in self.trainExamplesHistory:
-                trainExamples.extend(e)
-            shuffle(trainExamples)
+            trainExamples = self.getTrainExamples()
 
             # training new network, keeping a copy of the old one
             self.nnet.save_checkpoint(folder=self.args.checkpoint, filename='temp.pth.tar')
@@ -112,35 +341,74 @@ class Coach():
             pmcts = MCTS(self.game, self.pnet, self.args)
 
             self.nnet.train(trainExamples)
-            nmcts = MCTS(self.game, self.nnet, self.args)
+            if isinstance(trainExamples, ShardDataset):
+                trainExamples.close()
+            if self.evalCache is not None:
+                self.evalCache.invalidate()
+            nmcts = MCTS(self.game, self.nnet, self.args, self.evalCache)
 
             log.info('PITTING AGAINST PREVIOUS VERSION')
             arena = Arena(lambda x: np.argmax(pmcts.getActionProb(x, temp=0)),
-                          lambda x: np.argmax(nmcts.getActionProb(x, temp=0)), self.game)
+                          lambda x: np.argmax(nmcts.getActionProb(x, temp=0)), self.game,
+                          repetitionLimit=self.args.get('repetitionLimit', 0))
             pwins, nwins, draws = arena.playGames(self.args.arenaCompare)
+            log.info(f'ARENA TREE SIZES PREV: {pmcts.getTreeSize()} ; NEW: {nmcts.getTreeSize()}')
+            if nmcts.stats is not None:
+                log.debug(f'ARENA SEARCH STATS PREV: {pmcts.stats.toJSON()} ; NEW: {nmcts.stats.toJSON()}')
 
             log.info('NEW/PREV WINS : %d / %d ; DRAWS : %d' % (nwins, pwins, draws))
             if pwins + nwins == 0 or float(nwins) / (pwins + nwins) < self.args.updateThreshold:
                 log.info('REJECTING NEW MODEL')
                 self.nnet.load_checkpoint(folder=self.args.checkpoint, filename='temp.pth.tar')
+                if self.evalCache is not None:
+                    self.evalCache.invalidate()
             else:
                 log.info('ACCEPTING NEW MODEL')
                 self.nnet.save_checkpoint(folder=self.args.checkpoint, filename=self.getCheckpointFile(i))
                 self.nnet.save_checkpoint(folder=self.args.checkpoint, filename='best.pth.tar')
 
-    def getCheckpointFile(self, iteration):
+    @staticmethod
+    def getCheckpointFile(iteration):
         return 'checkpoint_' + str(iteration) + '.pth.tar'
 
     def saveTrainExamples(self, iteration):
-        folder = self.args.checkpoint
-        if not os.path.exists(folder):
-            os.makedirs(folder)
-        filename = os.path.join(folder, self.getCheckpointFile(iteration) + ".examples")
-        with open(filename, "wb+") as f:
-            Pickler(f).dump(self.trainExamplesHistory)
-        f.closed
+        """
+        Writes the examples of iteration, the last one added to the replay
+        buffer, as a new shard of the example store of args.checkpoint (see
+        ExampleStore.py), and deletes the shards beyond the
+        args.numItersForTrainExamplesHistory most recent ones. Every example
+        is thus written once, however many iterations it is trained on.
+        """
+        if iteration not in self.replayBuffer.getIterations():
+            return  # no example was kept
+        store = ExampleStore(os.path.join(self.args.checkpoint, 'examples'))
+        shard = store.write(*self.replayBuffer.getIteration(iteration))
+        deleted = store.prune(self.args.numItersForTrainExamplesHistory)
+        log.debug(f'Wrote the examples of iteration {iteration} to shard {shard}, deleted shards {deleted}')
 
     def loadTrainExamples(self):
+        """
+        Fills the replay buffer with the examples stored next to the model in
+        args.load_folder_file: the shards of its example store, memory-mapped
+        while they are copied, or the .examples file pickled by older versions.
+        """
+        store = ExampleStore(os.path.join(self.args.load_folder_file[0], 'examples'))
+        if store.exists() and self.args.get('streamTrainExamples', False):
+            if os.path.abspath(store.folder) != os.path.abspath(os.path.join(self.args.checkpoint, 'examples')):
+                log.warning(f'Only the trainExamples in {self.args.checkpoint} are streamed, not those in {store.folder}')
+            log.info(f"Streaming {len(store)} trainExamples from {len(store.getShards())} shards")
+            self.skipFirstSelfPlay = True
+            return
+        if store.exists():
+            shards = store.getShards()
+            log.info(f"Loading {len(store)} trainExamples from {len(shards)} shards...")
+            self.replayBuffer = ReplayBuffer(self.replayBuffer.maxSize)
+            for iteration, shard in enumerate(shards, 1 - len(shards)):
+                self.replayBuffer.addArrays(*store.load(shard), iteration)
+            log.info('Loading done!')
+            self.skipFirstSelfPlay = True
+            return
+
         modelFile = os.path.join(self.args.load_folder_file[0], self.args.load_folder_file[1])
         examplesFile = modelFile + ".examples"
         if not os.path.isfile(examplesFile):
@@ -151,7 +419,11 @@ class Coach():
         else:
             log.info("File with trainExamples found. Loading it...")
             with open(examplesFile, "rb") as f:
-                self.trainExamplesHistory = Unpickler(f).load()
+                examples = Unpickler(f).load()
+            # a trainExamplesHistory saved by older versions, one deque of examples per iteration
+            self.replayBuffer = ReplayBuffer(self.replayBuffer.maxSize)
+            for iteration, iterationTrainExamples in enumerate(examples, 1 - len(examples)):
+                self.replayBuffer.add(iterationTrainExamples, iteration)
             log.info('Loading done!')
 
             # examples based on the model were already collected (loaded)
@@ -0,0 +1,79 @@
+import threading
+from collections import OrderedDict
+
+
+class EvalCache():
+    """
+    A least recently used cache of neural network evaluations that can be
+    shared by several MCTS instances, e.g. by all the self-play episodes of an
+    iteration of Coach.learn.
+
+    Evaluations are keyed by the string representation of the canonical board
+    (its bytes for most games) and the version of the network that computed
+    them. invalidate must be called whenever the network changes (it is
+    trained or a checkpoint is loaded), older evaluations are never returned
+    afterwards. The cache can be shared between threads.
+    """
+
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self.version = 0  # bumped every time the network changes
+        self.entries = OrderedDict()  # (version, board s) -> (pi, v)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, s):
+        """
+        Returns:
+            (pi, v): the evaluation of board s by the current network, or None
+                     if it is not cached
+        """
+        with self.lock:
+            key = (self.version, s)
+            evaluation = self.entries.get(key)
+            if evaluation is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return evaluation
+
+    def put(self, s, pi, v):
+        """
+        Stores the evaluation of board s by the current network, dropping the
+        least recently used one if the cache is full.
+        """
+        with self.lock:
+            self.entries[(self.version, s)] = (pi, v)
+            if len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self):
+        """
+        Forgets all evaluations, to be called once the network has changed.
+        """
+        with self.lock:
+            self.version += 1
+            self.entries.clear()
+
+    def getStats(self, reset=False):
+        """
+        Returns:
+            stats: a dict with the number of cached evaluations ('size'), the
+                   hits and misses since the last reset and the hit rate
+        """
+        lookups = self.hits + self.misses
+        stats = {
+            'version': self.version,
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': self.hits / lookups if lookups else 0.,
+        }
+        if reset:
+            self.hits = self.misses = 0
+        return stats
@@ -0,0 +1,215 @@
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+
+
+class ExampleStore():
+    """
+    Training examples on disk, written once per self-play iteration as a
+    shard of three .npy files (boards, policies and values) in folder.
+
+    index.json lists the shards in the order they were written, with their
+    number of examples. It is replaced atomically after a shard is complete,
+    so a crash never leaves a half written shard listed. Shards are numbered
+    by the store itself, a run resumed from a checkpoint keeps adding to the
+    same store without overwriting older shards.
+
+    load memory-maps a shard, only the pages that are read are loaded. Shards
+    beyond the keep most recent ones are deleted by prune.
+    """
+
+    ARRAYS = ('boards', 'pis', 'vs')
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.nextShard = 0  # number of the next shard written
+        self.shards = []  # [shard, #examples] of every shard, oldest first
+        path = os.path.join(folder, 'index.json')
+        if os.path.isfile(path):
+            with open(path) as f:
+                index = json.load(f)
+            self.nextShard = index['next']
+            self.shards = index['shards']
+
+    def __len__(self):
+        return sum(n for _, n in self.shards)
+
+    def exists(self):
+        """
+        Returns:
+            exists: True if examples were written to folder
+        """
+        return os.path.isfile(os.path.join(self.folder, 'index.json'))
+
+    def getPath(self, shard, name):
+        return os.path.join(self.folder, f'shard_{shard:05d}.{name}.npy')
+
+    def write(self, boards, pis, vs):
+        """
+        Writes the examples of the arrays boards, pis and vs as a new shard.
+
+        Returns:
+            shard: the number of the shard
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        shard = self.nextShard
+        for name, array in zip(self.ARRAYS, (boards, pis, vs)):
+            np.save(self.getPath(shard, name), np.ascontiguousarray(array))
+        self.nextShard += 1
+        self.shards.append([shard, len(vs)])
+        self.writeIndex()
+        return shard
+
+    def writeIndex(self):
+        path = os.path.join(self.folder, 'index.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'next': self.nextShard, 'shards': self.shards}, f)
+        os.replace(path + '.tmp', path)
+
+    def getShards(self):
+        """
+        Returns:
+            shards: the numbers of the stored shards, oldest first
+        """
+        return [shard for shard, _ in self.shards]
+
+    def load(self, shard, mmap=True):
+        """
+        Returns:
+            boards, pis, vs: the arrays of shard, memory-mapped read-only
+                             unless mmap is False
+        """
+        mode = 'r' if mmap else None
+        return tuple(np.load(self.getPath(shard, name), mmap_mode=mode) for name in self.ARRAYS)
+
+    def prune(self, keep):
+        """
+        Deletes all shards but the keep most recent ones.
+
+        Returns:
+            deleted: the numbers of the deleted shards
+        """
+        deleted = self.getShards()[:max(0, len(self.shards) - keep)]
+        if not deleted:
+            return []
+        self.shards = self.shards[len(deleted):]
+        self.writeIndex()
+        for shard in deleted:
+            for name in self.ARRAYS:
+                path = self.getPath(shard, name)
+                if os.path.isfile(path):
+                    os.remove(path)
+        return deleted
+
+
+class ShardDataset():
+    """
+    A source of training batches read straight from the memory-mapped shards
+    of an ExampleStore, for histories larger than memory. Only the rows of
+    the sampled examples are read from disk.
+
+    It has the sample and __len__ of ReplayBuffer, so the NNetWrapper.train
+    methods accept either (see ReplayBuffer.sampleBatch and fitExamples).
+    With prefetch > 0, a background thread keeps up to that many batches
+    ready while the network trains on the previous ones. close stops it.
+    """
+
+    def __init__(self, store, shards=None, prefetch=0):
+        shards = store.getShards() if shards is None else shards
+        self.arrays = [store.load(shard) for shard in shards]  # (boards, pis, vs) of every shard
+        self.ends = np.cumsum([len(vs) for _, _, vs in self.arrays])  # index after the last example of each shard
+        self.prefetch = prefetch
+        self.batches = None  # queue of the prefetched batches
+        self.batchSize = None  # size of the prefetched batches
+        self.stop = threading.Event()
+        self.thread = None
+
+    def __len__(self):
+        return int(self.ends[-1]) if len(self.ends) else 0
+
+    def read(self, ids):
+        """
+        Returns:
+            boards, pis, vs: arrays with the examples of the sorted indices ids
+        """
+        shards = np.searchsorted(self.ends, ids, side='right')
+        parts = []
+        for shard in np.unique(shards):
+            local = ids[shards == shard] - (self.ends[shard - 1] if shard else 0)
+            parts.append([array[local] for array in self.arrays[shard]])
+        return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+    def draw(self, batchSize):
+        # sorted indices read the shards front to back
+        return self.read(np.sort(np.random.randint(len(self), size=batchSize)))
+
+    def sample(self, batchSize):
+        """
+        Returns:
+            boards, pis, vs: arrays with batchSize examples drawn uniformly at
+                             random, with replacement
+        """
+        if not len(self):
+            raise ValueError('Can not sample from a ShardDataset without examples')
+        if not self.prefetch:
+            return self.draw(batchSize)
+        if self.thread is None or batchSize != self.batchSize:
+            self.close()
+            self.startPrefetch(batchSize)
+        batch = self.batches.get()
+        if isinstance(batch, Exception):
+            self.close()
+            raise RuntimeError('Prefetching a batch failed') from batch
+        return batch
+
+    def startPrefetch(self, batchSize):
+        self.batchSize = batchSize
+        self.batches = queue.Queue(maxsize=self.prefetch)
+        self.stop.clear()
+        self.thread = threading.Thread(target=self.prefetchBatches, args=(batchSize, self.batches), daemon=True)
+        self.thread.start()
+
+    def prefetchBatches(self, batchSize, batches):
+        """
+        Body of the prefetch thread.
+        """
+        while not self.stop.is_set():
+            try:
+                batch = self.draw(batchSize)
+            except Exception as e:
+                batch = e  # raised by sample
+            while not self.stop.is_set():
+                try:
+                    batches.put(batch, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+    def close(self):
+        """
+        Stops the prefetch thread, if any.
+        """
+        if self.thread is not None:
+            self.stop.set()
+            self.thread.join()
+            self.thread = None
+
+    def generate(self, batchSize):
+        """
+        Yields batches of batchSize examples as (boards, [pis, vs]) forever,
+        the format of Keras Model.fit.
+        """
+        while True:
+            boards, pis, vs = self.sample(batchSize)
+            yield boards, [pis, vs]
+
+    def toArrays(self):
+        """
+        Returns:
+            boards, pis, vs: all examples read into memory, for the wrappers
+                             that need them at once
+        """
+        return tuple(np.concatenate(arrays) for arrays in zip(*self.arrays))
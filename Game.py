@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class Game():
     """
     This class specifies the base Game class. To define your own game, subclass
@@ -59,6 +62,20 @@ class Game():
         """
         pass
 
+    def getValidActions(self, board, player):
+        """
+        Input:
+            board: current board
+            player: current player
+
+        Returns:
+            actions: a sorted array with the ids of the valid moves of board,
+                     the indices of the ones in getValidMoves. Used by MCTS,
+                     which only stores the legal actions of every board.
+                     Override it if the ids are cheaper to compute directly.
+        """
+        return np.flatnonzero(self.getValidMoves(board, player))
+
     def getGameEnded(self, board, player):
         """
         Input:
@@ -101,6 +118,25 @@ class Game():
         """
         pass
 
+    def getCanonicalSymmetry(self, board):
+        """
+        Input:
+            board: current board in its canonical form
+
+        Returns:
+            symmBoard: the representative of the symmetry class of board, the
+                       same board for every symmetrical form of it. Used by
+                       MCTS to store a single node per class (mctsSymmetry).
+            perm: an array such that action a on symmBoard is action perm[a]
+                  on board
+
+        The default implementation picks the form returned by getSymmetries
+        with the smallest string representation.
+        """
+        forms = self.getSymmetries(board, np.arange(self.getActionSize()))
+        symmBoard, perm = min(forms, key=lambda form: self.stringRepresentation(form[0]))
+        return np.array(symmBoard), np.asarray(perm, dtype=np.int64)
+
     def stringRepresentation(self, board):
         """
         Input:
@@ -111,3 +147,19 @@ class Game():
                          Required by MCTS for hashing.
         """
         pass
+
+    def getRepetitionKey(self, board):
+        """
+        Input:
+            board: current board
+
+        Returns:
+            key: a hashable key that is equal for boards holding the same
+                 position, used to detect repetitions (args.repetitionLimit
+                 in Coach and Arena, args.mctsCycleDetection in MCTS).
+
+        The default implementation returns the string representation. Games
+        whose boards carry a move counter or other history should leave it
+        out, or a repeated position is never recognized.
+        """
+        return self.stringRepresentation(board)
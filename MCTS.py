@@ -1,58 +1,530 @@
+import heapq
 import logging
 import math
+import sys
+import time
 
 import numpy as np
 
+from SearchStats import SearchStats
+
 EPS = 1e-8
 
 log = logging.getLogger(__name__)
 
+# options only NodeMCTS implements, with their value when unused
+NODE_TABLE_OPTIONS = {'mctsBatchSize': 1, 'mctsSolver': False, 'mctsCompactNodes': False}
+ignoredOptions = set()  # NODE_TABLE_OPTIONS already reported as ignored by the dict layout
+
+
+def maskPolicy(pi, actions):
+    """
+    Returns:
+        Ps: the policy pi returned by the neural network restricted to the
+            legal actions and renormalized, uniform if pi gives them no mass
+    """
+    Ps = np.asarray(pi)[actions].astype(np.float64)
+    sum_Ps_s = np.sum(Ps)
+    if sum_Ps_s > 0:
+        Ps /= sum_Ps_s
+    else:
+        log.error("All valid moves were masked, doing a workaround.")
+        Ps = np.full(len(actions), 1. / len(actions))
+    return Ps
+
+
+def countsToPolicy(counts, temp):
+    """
+    Returns:
+        probs: a policy vector where the probability of the ith action is
+               proportional to counts[i]**(1./temp), all on one of the most
+               visited actions if temp is 0
+    """
+    if temp == 0:
+        bestAs = np.array(np.argwhere(counts == np.max(counts))).flatten()
+        bestA = np.random.choice(bestAs)
+        probs = [0] * len(counts)
+        probs[bestA] = 1
+        return probs
+
+    counts = [x ** (1. / temp) for x in counts]
+    counts_sum = float(sum(counts))
+    probs = [x / counts_sum for x in counts]
+    return probs
+
+
+def sizeOfTable(table, values=True):
+    """
+    Returns:
+        bytes: approximate memory held by a dict of the tree: the dict itself,
+               its (s,a) tuple keys and, if values is set, its values. Board
+               strings are shared between the tables and are not counted.
+    """
+    size = sys.getsizeof(table)
+    for key, value in table.items():
+        if values:
+            size += sys.getsizeof(value)
+        if isinstance(key, tuple):
+            size += sys.getsizeof(key)
+    return size
+
 
 class MCTS():
     """
     This class handles the MCTS tree.
+
+    If args.mctsNodeTable is set, constructing an MCTS returns a NodeMCTS
+    instead, which keeps the statistics of every expanded state in numpy arrays
+    (see NodeMCTS.py). The options of NODE_TABLE_OPTIONS need it, a warning
+    is logged once if one of them is set without it.
+
+    If args.mctsIterative is set, simulations run searchIterative, which walks
+    the tree with an explicit path instead of recursing once per ply.
+
+    If args.mctsMaxNodes is set, the tree is kept below that many boards by
+    evicting the least recently visited ones (args.mctsEvictionPolicy 'lru')
+    or the least visited ones ('visits') between simulations. The root of the
+    search is never evicted.
+
+    Every visited edge remembers the board it leads to and the next player.
+    With args.mctsTransitionCache set, up to that many canonical boards are
+    kept as well, so traversing a known edge costs dictionary lookups instead
+    of getNextState, getCanonicalForm and stringRepresentation.
+
+    With args.mctsForcedMoves set, boards with a single valid move (passes,
+    tictacshoot turns where only END_TURN is left) are expanded without
+    calling the neural network and simulations walk straight through them.
+    With args.mctsSkipForcedRoot set, getActionProb returns right away when
+    the root itself has a single valid move. forcedNodes and skippedSims
+    count the network calls and simulations that were saved.
+
+    With args.mctsWidening = c > 0, a board visited n times only considers
+    its c * (n+1)**args.mctsWideningExponent legal actions with the highest
+    prior (progressive widening), so selection does not get slower with the
+    branching factor.
+
+    With args.mctsCycleDetection set, a simulation that reaches a position
+    already on its path from the root (see Game.getRepetitionKey) stops there
+    and values it as a draw, so descents cannot walk around cycles of games
+    like tictacshoot, where SPIN brings positions back.
+
+    With args.mctsDirichletEpsilon > 0, Dirichlet noise is mixed into the
+    priors of the root of a getActionProb call, as in AlphaZero, once per
+    board. With progressive widening, the actions keep their order by the
+    priors without noise.
+
+    With args.mctsSymmetry set, boards are replaced by the representative of
+    their symmetry class, so rotated or mirrored positions share one node and
+    one network evaluation.
+
+    getActionProb stops before numMCTSSims simulations once args.mctsTimeBudget
+    seconds have passed, and, with args.mctsEarlyStop set, as soon as the most
+    visited action of the root can no longer be overtaken by the simulations
+    left. lastSearch holds the simulations run, the seconds spent and the
+    reason the last call stopped, as well as the value of the root found by
+    the search (see getValue).
+
+    With args.mctsStats set, stats collects counters and per-phase timers of
+    the search (see SearchStats.py), read with getStats.
+
+    If an evalCache is given (see EvalCache.py), the neural network evaluations
+    are looked up in and added to it, so MCTS instances sharing it only
+    evaluate a board once.
     """
 
-    def __init__(self, game, nnet, args):
+    def __new__(cls, game, nnet, args, evalCache=None):
+        if cls is MCTS and args.get('mctsNodeTable', False):
+            from NodeMCTS import NodeMCTS
+            cls = NodeMCTS
+        return super().__new__(cls)
+
+    def __init__(self, game, nnet, args, evalCache=None):
         self.game = game
         self.nnet = nnet
         self.args = args
+        self.evalCache = evalCache
         self.Qsa = {}  # stores Q values for s,a (as defined in the paper)
         self.Nsa = {}  # stores #times edge s,a was visited
         self.Ns = {}  # stores #times board s was visited
-        self.Ps = {}  # stores initial policy (returned by neural net)
+        self.Ps = {}  # stores initial policy of each action in Vs[s] (returned by neural net)
 
+        self.Vs = {}  # stores game.getValidActions for board s, the ids of its legal actions
+        self.Cs = {}  # stores (board s, next player) reached by taking edge s,a
+        self.initSearch()
+
+        for key, unused in NODE_TABLE_OPTIONS.items():
+            if args.get(key, unused) != unused and key not in ignoredOptions:
+                log.warning(f'args.{key} is ignored without args.mctsNodeTable')
+                ignoredOptions.add(key)
+
+    def initSearch(self):
+        """
+        Sets up what every tree layout shares: the search options read from
+        args and the tables kept for every visited board s.
+        """
         self.Es = {}  # stores game.getGameEnded ended for board s
-        self.Vs = {}  # stores game.getValidMoves for board s
+        self.Ts = {}  # stores the tick at which board s was last visited (only with mctsMaxNodes)
+        self.Bs = {}  # stores the canonical board of board s (at most mctsTransitionCache of them)
+        self.Ds = set()  # stores the boards s whose priors hold Dirichlet noise
+
+        self.root = None  # board s of the last getActionProb call
+        self.tick = 0  # #simulation steps run so far
+        self.iterative = self.args.get('mctsIterative', False)
+        self.maxNodes = self.args.get('mctsMaxNodes', 0)
+        self.evictionPolicy = self.args.get('mctsEvictionPolicy', 'lru')
+        self.maxBoards = self.args.get('mctsTransitionCache', 0)
+        self.forcedMoves = self.args.get('mctsForcedMoves', False)
+        self.skipForcedRoot = self.args.get('mctsSkipForcedRoot', False)
+        self.solver = self.args.get('mctsSolver', False)
+        self.timeBudget = self.args.get('mctsTimeBudget', 0)
+        self.earlyStop = self.args.get('mctsEarlyStop', False)
+        self.symmetry = self.args.get('mctsSymmetry', False)
+        self.dirichletEpsilon = self.args.get('mctsDirichletEpsilon', 0)
+        self.dirichletAlpha = self.args.get('mctsDirichletAlpha', 0.3)
+        self.widening = self.args.get('mctsWidening', 0)
+        self.wideningExponent = self.args.get('mctsWideningExponent', 0.5)
+        self.cycleDetection = self.args.get('mctsCycleDetection', False)
+        self.pathKeys = set()  # repetition keys of the boards on the path of the running search
 
-    def getActionProb(self, canonicalBoard, temp=1):
+        self.forcedNodes = 0  # #boards with a single valid move expanded without the neural network
+        self.skippedSims = 0  # #simulations not run because the root had a single valid move
+        self.lastSearch = None  # {'sims', 'seconds', 'stop', 'value'} of the last getActionProb call
+
+        self.stats = None
+        if self.args.get('mctsStats', False):
+            self.stats = SearchStats()
+            self.game = self.stats.wrap(self.game, SearchStats.GAME_PHASES)
+            self.nnet = self.stats.wrap(self.nnet, SearchStats.NNET_PHASES)
+            for name in ('selectAction', 'select'):
+                if hasattr(self, name):
+                    setattr(self, name, self.stats.timed('selection', getattr(self, name)))
+
+    def getActionProb(self, canonicalBoard, temp=1, numSims=None):
         """
-        This function performs numMCTSSims simulations of MCTS starting from
-        canonicalBoard.
+        This function performs numSims (args.numMCTSSims by default)
+        simulations of MCTS starting from canonicalBoard, fewer if
+        args.mctsTimeBudget or args.mctsEarlyStop stop the search first (see
+        runSimulations).
+
+        If args.mctsReuseTree is set, the statistics of canonicalBoard and the
+        states below it are kept from the previous calls and everything that
+        can no longer be reached is dropped (see advanceRoot).
+
+        If args.mctsSymmetry is set, the search runs from the representative of
+        the symmetry class of canonicalBoard (see Game.getCanonicalSymmetry)
+        and every board in the tree is stored in its representative form.
 
         Returns:
             probs: a policy vector where the probability of the ith action is
                    proportional to Nsa[(s,a)]**(1./temp)
         """
-        for i in range(self.args.numMCTSSims):
-            self.search(canonicalBoard)
+        if numSims is None:
+            numSims = self.args.numMCTSSims
+        if not self.symmetry:
+            return self.searchRoot(canonicalBoard, temp, numSims)
+        symmBoard, perm = self.game.getCanonicalSymmetry(canonicalBoard)
+        probs = [0] * len(perm)
+        for a, p in zip(perm, self.searchRoot(symmBoard, temp, numSims)):
+            probs[a] = p
+        return probs
 
+    def searchRoot(self, canonicalBoard, temp, numSims):
+        """
+        Searches from canonicalBoard as described in getActionProb, without
+        mapping it to its symmetry class.
+
+        Returns:
+            probs: the policy vector of canonicalBoard
+        """
+        start = time.perf_counter()
         s = self.game.stringRepresentation(canonicalBoard)
-        counts = [self.Nsa[(s, a)] if (s, a) in self.Nsa else 0 for a in range(self.game.getActionSize())]
+        if self.args.get('mctsReuseTree', False) and s != self.root:
+            self.advanceRoot(canonicalBoard)
+
+        if self.skipForcedRoot:
+            actions = self.game.getValidActions(canonicalBoard, 1)
+            if len(actions) == 1:
+                self.skippedSims += numSims
+                self.endSearch(s, 0, start, 'forced')
+                probs = [0] * self.game.getActionSize()
+                probs[actions[0]] = 1
+                return probs
 
-        if temp == 0:
-            bestAs = np.array(np.argwhere(counts == np.max(counts))).flatten()
-            bestA = np.random.choice(bestAs)
-            probs = [0] * len(counts)
-            probs[bestA] = 1
+        sims, stop = self.runSimulations(canonicalBoard, s, start, numSims)
+        self.endSearch(s, sims, start, stop)
+
+        if self.solver and self.getProvenAction(s) is not None:
+            probs = [0] * self.game.getActionSize()
+            probs[self.getProvenAction(s)] = 1
             return probs
 
-        counts = [x ** (1. / temp) for x in counts]
-        counts_sum = float(sum(counts))
-        probs = [x / counts_sum for x in counts]
-        return probs
+        return countsToPolicy(self.getVisitCounts(s), temp)
+
+    def runSimulations(self, canonicalBoard, s, start, numSims):
+        """
+        Runs simulations from canonicalBoard until numSims have been run or
+        one of the other stopping rules applies. At least one simulation is
+        run unless the root is already proven.
+
+        Returns:
+            sims: the number of simulations that were run
+            stop: why the search stopped, 'sims', 'time', 'early' or 'solved'
+        """
+        deadline = start + self.timeBudget if self.timeBudget else None
+        noise = self.dirichletEpsilon > 0 and s not in self.Ds
+        sims = 0
+        while sims < numSims:
+            if self.solver and self.getProvenAction(s) is not None:
+                return sims, 'solved'
+            if sims > 0:
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return sims, 'time'
+                if self.earlyStop and self.getLead(s) > numSims - sims:
+                    return sims, 'early'
+            if noise and self.addRootNoise(s):
+                self.Ds.add(s)
+                noise = False
+            sims += self.simulate(canonicalBoard, numSims - sims)
+            self.tick += 1
+            if self.maxNodes and len(self.Es) > self.maxNodes:
+                self.evict(s)
+        return sims, 'sims'
+
+    def addRootNoise(self, s):
+        """
+        Mixes Dirichlet noise of concentration args.mctsDirichletAlpha into the
+        priors of board s, with weight args.mctsDirichletEpsilon.
+
+        Returns:
+            added: False if board s has not been expanded yet
+        """
+        if s not in self.Ps:
+            return False
+        noise = np.random.dirichlet([self.dirichletAlpha] * len(self.Ps[s]))
+        self.Ps[s] = (1 - self.dirichletEpsilon) * self.Ps[s] + self.dirichletEpsilon * noise
+        return True
+
+    def endSearch(self, s, sims, start, stop):
+        """
+        Records the statistics of a getActionProb call from board s in
+        lastSearch.
+        """
+        self.lastSearch = {'sims': sims, 'seconds': time.perf_counter() - start, 'stop': stop,
+                           'value': self.getValue(s)}
+        if self.stats is not None:
+            self.stats.count('searches')
+            self.stats.count('sims', sims)
+        if stop != 'sims':
+            log.debug(f'Search stopped ({stop}) after {sims} simulations in {self.lastSearch["seconds"]:.3f}s')
+
+    def getStats(self, reset=False):
+        """
+        Returns:
+            stats: a snapshot of the counters and timers collected since the
+                   last reset (see SearchStats.snapshot), None if args.mctsStats
+                   is not set
+        """
+        if self.stats is None:
+            return None
+        stats = self.stats.snapshot()
+        if reset:
+            self.stats.reset()
+        return stats
+
+    def getLead(self, s):
+        """
+        Returns:
+            lead: how many more visits the most visited edge of board s has
+                  than the second one (all its visits if it is the only edge)
+        """
+        if s not in self.Vs:
+            return 0
+        counts = sorted((self.Nsa.get((s, a), 0) for a in self.Vs[s]), reverse=True)
+        return counts[0] - (counts[1] if len(counts) > 1 else 0)
+
+    def advanceRoot(self, canonicalBoard):
+        """
+        Makes canonicalBoard the root of the tree: the statistics of every state
+        reachable from it through the visited edges are kept, all other states
+        are dropped.
+
+        Returns:
+            dropped: the number of states that were dropped
+        """
+        self.root = self.game.stringRepresentation(canonicalBoard)
+        reachable = {self.root}
+        stack = [self.root]
+        while stack:
+            for child in self.getChildren(stack.pop()):
+                if child not in reachable:
+                    reachable.add(child)
+                    stack.append(child)
+
+        unreachable = [s for s in self.Es if s not in reachable]
+        for s in unreachable:
+            self.dropState(s)
+        return len(unreachable)
+
+    def evict(self, root):
+        """
+        Drops boards according to args.mctsEvictionPolicy until the tree holds
+        at most 90% of args.mctsMaxNodes boards. The board root is kept.
+
+        Returns:
+            evicted: the number of boards that were dropped
+        """
+        excess = len(self.Es) - int(0.9 * self.maxNodes)
+        if excess <= 0:
+            return 0
+        if self.evictionPolicy == 'visits':
+            key = self.getStateVisits
+        else:
+            key = lambda s: self.Ts.get(s, -1)
+        victims = heapq.nsmallest(excess, (s for s in self.Es if s != root), key=key)
+        for s in victims:
+            self.dropState(s)
+        return len(victims)
+
+    def getTreeSize(self):
+        """
+        Returns:
+            size: a dict with the number of boards in the tree ('nodes'), the
+                  number of expanded ones ('expanded') and the approximate
+                  number of bytes used by the tables ('bytes')
+        """
+        size = sum(sys.getsizeof(s) for s in self.Es)
+        tables = (self.Qsa, self.Nsa, self.Ns, self.Ps, self.Es, self.Vs, self.Ts, self.Bs)
+        size += sum(sizeOfTable(table) for table in tables)
+        size += sizeOfTable(self.Cs, values=False)
+        return {
+            'nodes': len(self.Es),
+            'expanded': len(self.Ps),
+            'bytes': size,
+        }
+
+    def getValue(self, s):
+        """
+        Returns:
+            v: the mean value of the simulations through board s for the
+               player to move, None if no simulation went through it
+        """
+        if not self.Ns.get(s):
+            return None
+        return sum(self.Nsa.get((s, a), 0) * self.Qsa.get((s, a), 0) for a in self.Vs[s]) / self.Ns[s]
 
-    def search(self, canonicalBoard):
+    def getStateVisits(self, s):
+        """
+        Returns:
+            n: #times board s was visited
+        """
+        return self.Ns.get(s, 0)
+
+    def getChildren(self, s):
+        """
+        Returns:
+            children: the boards reached by the visited edges of board s
+        """
+        if s not in self.Vs:
+            return []
+        return [self.Cs[(s, a)][0] for a in self.Vs[s] if (s, a) in self.Cs]
+
+    def dropState(self, s):
+        """
+        Removes board s and the statistics of its edges from the tree.
+        """
+        if s in self.Vs:
+            for a in self.Vs[s]:
+                self.Qsa.pop((s, a), None)
+                self.Nsa.pop((s, a), None)
+                self.Cs.pop((s, a), None)
+        for table in (self.Ns, self.Ps, self.Es, self.Vs, self.Ts, self.Bs):
+            table.pop(s, None)
+        self.Ds.discard(s)
+
+    def getTransition(self, canonicalBoard, a, children, edge):
+        """
+        Takes action a on canonicalBoard. The result is remembered in
+        children[edge] and, if there is room, the board in Bs, so that the
+        next traversal of the edge is a lookup.
+
+        Returns:
+            nextBoard: the canonical form of the next board (its representative
+                       form if args.mctsSymmetry is set)
+            next_s: the string representation of nextBoard
+            nextPlayer: the player to move on the next board, 1 if it is still
+                        the current player
+        """
+        transition = children.get(edge)
+        if transition is not None and transition[0] in self.Bs:
+            if self.stats is not None:
+                self.stats.count('cacheHits')
+            return self.Bs[transition[0]], transition[0], transition[1]
+
+        nextBoard, nextPlayer = self.game.getNextState(canonicalBoard, 1, a)
+        nextBoard = self.game.getCanonicalForm(nextBoard, nextPlayer)
+        if self.symmetry:
+            nextBoard, _ = self.game.getCanonicalSymmetry(nextBoard)
+        next_s = self.game.stringRepresentation(nextBoard) if transition is None else transition[0]
+        children[edge] = (next_s, nextPlayer)
+        if self.maxBoards:
+            if len(self.Bs) >= self.maxBoards:
+                del self.Bs[next(iter(self.Bs))]
+            self.Bs[next_s] = nextBoard
+        return nextBoard, next_s, nextPlayer
+
+    def simulate(self, canonicalBoard, maxSims):
+        """
+        Runs at most maxSims (and at least one) simulations from canonicalBoard.
+
+        Returns:
+            sims: the number of simulations that were run
+        """
+        if self.iterative:
+            self.searchIterative(canonicalBoard)
+        else:
+            self.search(canonicalBoard)
+        return 1
+
+    def getProvenAction(self, s):
+        """
+        Returns:
+            a: the best action of board s if its value has been proven by the
+               solver (args.mctsSolver, NodeMCTS only), else None
+        """
+        return None
+
+    def getRootCounts(self, canonicalBoard):
+        """
+        Returns:
+            counts: the visit count of every action of canonicalBoard, the
+                    board of the last getActionProb call (mapped back from its
+                    symmetry class with args.mctsSymmetry), or None if that
+                    call chose its move without them: a forced root skipped
+                    with args.mctsSkipForcedRoot or a root proven by the solver
+        """
+        perm = None
+        if self.symmetry:
+            canonicalBoard, perm = self.game.getCanonicalSymmetry(canonicalBoard)
+        s = self.game.stringRepresentation(canonicalBoard)
+        if self.lastSearch['stop'] == 'forced' or (self.solver and self.getProvenAction(s) is not None):
+            return None
+        counts = np.asarray(self.getVisitCounts(s))
+        if perm is not None:
+            counts, symmCounts = np.zeros_like(counts), counts
+            counts[perm] = symmCounts
+        return counts
+
+    def getVisitCounts(self, s):
+        """
+        Returns:
+            counts: a list with the visit count Nsa[(s,a)] of every action a
+        """
+        counts = [0] * self.game.getActionSize()
+        for a in self.Vs.get(s, ()):
+            counts[a] = self.Nsa.get((s, a), 0)
+        return counts
+
+    def search(self, canonicalBoard, s=None, depth=0):
         """
         This function performs one iteration of MCTS. It is recursively called
         till a leaf node is found. The action chosen at each node is one that
@@ -72,54 +544,211 @@ class MCTS():
             v: the negative of the value of the current canonicalBoard
         """
 
-        s = self.game.stringRepresentation(canonicalBoard)
+        if s is None:
+            s = self.game.stringRepresentation(canonicalBoard)
+        if self.maxNodes:
+            self.Ts[s] = self.tick
 
         if s not in self.Es:
             self.Es[s] = self.game.getGameEnded(canonicalBoard, 1)
         #terminal node
         if self.Es[s] != 0:
+            if self.stats is not None:
+                self.stats.count('terminalHits')
+                self.stats.addDepth(depth)
             return self.Es[s]  # was: return -self.Es[s]
 
+        if self.cycleDetection:
+            if depth == 0:
+                self.pathKeys = set()
+            if self.closesCycle(canonicalBoard, self.pathKeys):
+                if self.stats is not None:
+                    self.stats.addDepth(depth)
+                return 0
+
         # leaf node
         if s not in self.Ps:
-            self.Ps[s], v = self.nnet.predict(canonicalBoard)
-            valids = self.game.getValidMoves(canonicalBoard, 1)
-            self.Ps[s] = self.Ps[s] * valids
-            sum_Ps_s = np.sum(self.Ps[s])
-            if sum_Ps_s > 0:
-                self.Ps[s] /= sum_Ps_s
-            else:
-                log.error("All valid moves were masked, doing a workaround.")
-                self.Ps[s] = self.Ps[s] + valids
-                self.Ps[s] /= np.sum(self.Ps[s])
-            self.Vs[s] = valids
-            self.Ns[s] = 0
-            return v  # was: return -v
-
-        valids = self.Vs[s]
+            v = self.expand(canonicalBoard, s)
+            if v is not None:
+                if self.stats is not None:
+                    self.stats.addDepth(depth)
+                return v  # was: return -v
+
+        a = self.selectAction(s)
+        next_board, next_s, next_player = self.getTransition(canonicalBoard, a, self.Cs, (s, a))
+
+        v_child = self.search(next_board, next_s, depth + 1)
+        v = v_child if next_player == 1 else -v_child
+
+        self.update(s, a, v)
+        return v
+
+    def searchIterative(self, canonicalBoard):
+        """
+        Performs the same iteration of MCTS as search, with an explicit path
+        instead of one recursive call per ply: the edges are collected on the
+        way down and updated in reverse order once the leaf has been valued.
+        Deep games no longer run into the recursion limit.
+
+        Returns:
+            v: the value of the current canonicalBoard
+        """
+        path = []  # (s, a, flip) for every traversed edge
+        keys = set()  # repetition keys of the boards on path (only with mctsCycleDetection)
+        board = canonicalBoard
+        s = self.game.stringRepresentation(board)
+        while True:
+            if self.maxNodes:
+                self.Ts[s] = self.tick
+
+            if s not in self.Es:
+                self.Es[s] = self.game.getGameEnded(board, 1)
+            # terminal node
+            if self.Es[s] != 0:
+                v = self.Es[s]
+                if self.stats is not None:
+                    self.stats.count('terminalHits')
+                break
+            if self.cycleDetection and self.closesCycle(board, keys):
+                v = 0
+                break
+            # leaf node
+            if s not in self.Ps:
+                v = self.expand(board, s)
+                if v is not None:
+                    break
+
+            a = self.selectAction(s)
+            board, next_s, next_player = self.getTransition(board, a, self.Cs, (s, a))
+            path.append((s, a, next_player != 1))
+            s = next_s
+
+        if self.stats is not None:
+            self.stats.addDepth(len(path))
+        for s, a, flip in reversed(path):
+            if flip:
+                v = -v
+            self.update(s, a, v)
+        return v
+
+    def closesCycle(self, board, keys):
+        """
+        Adds the repetition key of board to keys, the keys of the boards on
+        the current path of the search.
+
+        Returns:
+            cycle: True if board repeats a position already on the path, the
+                   simulation then ends there with the value of a draw
+        """
+        key = self.game.getRepetitionKey(board)
+        if key in keys:
+            if self.stats is not None:
+                self.stats.count('cycleHits')
+            return True
+        keys.add(key)
+        return False
+
+    def isForced(self, actions):
+        """
+        Returns:
+            forced: True if forced moves are skipped and actions, the legal
+                    actions of a board, hold a single one
+        """
+        if self.forcedMoves and len(actions) == 1:
+            self.forcedNodes += 1
+            return True
+        return False
+
+    def expand(self, canonicalBoard, s):
+        """
+        Evaluates the leaf canonicalBoard with the neural network and stores
+        its legal actions in Vs[s] and their renormalized policy in Ps[s].
+
+        Returns:
+            v: the value of canonicalBoard returned by the neural network, or
+               None if the board has a single valid move that is played
+               without evaluating it (see isForced)
+        """
+        if self.stats is not None:
+            self.stats.count('nodes')
+        actions = self.game.getValidActions(canonicalBoard, 1)
+        self.Vs[s] = actions
+        self.Ns[s] = 0
+        if self.isForced(actions):
+            self.Ps[s] = np.ones(1)
+            return None
+
+        pi, v = self.evaluate(canonicalBoard, s)
+        self.Vs[s], self.Ps[s] = self.sortByPrior(actions, maskPolicy(pi, actions))
+        return v
+
+    def sortByPrior(self, actions, Ps):
+        """
+        Returns:
+            actions, Ps: sorted by decreasing prior if progressive widening is
+                         on (stable, so equal priors keep their order),
+                         unchanged otherwise
+        """
+        if not self.widening:
+            return actions, Ps
+        order = np.argsort(-Ps, kind='stable')
+        return actions[order], Ps[order]
+
+    def getWidth(self, n):
+        """
+        Returns:
+            k: the number of actions, by decreasing prior, that a board visited
+               n times considers with progressive widening
+        """
+        return max(1, int(self.widening * (n + 1) ** self.wideningExponent))
+
+    def evaluate(self, canonicalBoard, s):
+        """
+        Returns:
+            pi: the policy of board s returned by the neural network, or found
+                in evalCache
+            v: the value of board s, from the same evaluation
+        """
+        if self.evalCache is not None:
+            evaluation = self.evalCache.get(s)
+            if evaluation is not None:
+                return evaluation
+        pi, v = self.nnet.predict(canonicalBoard)
+        if self.evalCache is not None:
+            self.evalCache.put(s, pi, v)
+        return pi, v
+
+    def selectAction(self, s):
+        """
+        Returns:
+            a: the valid action of board s with the highest upper confidence
+               bound
+        """
         cur_best = -float('inf')
         best_act = -1
+        actions, Ps = self.Vs[s], self.Ps[s]
+        if self.widening:
+            k = self.getWidth(self.Ns[s])
+            actions, Ps = actions[:k], Ps[:k]
 
         # pick the action with the highest upper confidence bound
-        for a in range(self.game.getActionSize()):
-            if valids[a]:
-                if (s, a) in self.Qsa:
-                    u = self.Qsa[(s, a)] + self.args.cpuct * self.Ps[s][a] * math.sqrt(self.Ns[s]) / (
-                            1 + self.Nsa[(s, a)])
-                else:
-                    u = self.args.cpuct * self.Ps[s][a] * math.sqrt(self.Ns[s] + EPS)  # Q = 0 ?
-
-                if u > cur_best:
-                    cur_best = u
-                    best_act = a
-
-        a = best_act
-        next_s, next_player = self.game.getNextState(canonicalBoard, 1, a)
-        next_s = self.game.getCanonicalForm(next_s, next_player)
-
-        v_child = self.search(next_s)
-        v = v_child if next_player == 1 else -v_child
+        for a, p in zip(actions.tolist(), Ps.tolist()):
+            if (s, a) in self.Qsa:
+                u = self.Qsa[(s, a)] + self.args.cpuct * p * math.sqrt(self.Ns[s]) / (
+                        1 + self.Nsa[(s, a)])
+            else:
+                u = self.args.cpuct * p * math.sqrt(self.Ns[s] + EPS)  # Q = 0 ?
+
+            if u > cur_best:
+                cur_best = u
+                best_act = a
+
+        return best_act
 
+    def update(self, s, a, v):
+        """
+        Adds the value v, seen from board s, to the statistics of edge s,a.
+        """
         if (s, a) in self.Qsa:
             self.Qsa[(s, a)] = (self.Nsa[(s, a)] * self.Qsa[(s, a)] + v) / (self.Nsa[(s, a)] + 1)
             self.Nsa[(s, a)] += 1
@@ -128,4 +757,3 @@ class MCTS():
             self.Nsa[(s, a)] = 1
 
         self.Ns[s] += 1
-        return v
\ No newline at end of file
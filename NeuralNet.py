@@ -36,6 +36,25 @@ class NeuralNet():
         """
         pass
 
+    def predict_batch(self, boards):
+        """
+        Input:
+            boards: a list of boards in their canonical form.
+
+        Returns:
+            pis: the policy vector of each board, in the same order
+            vs: the value of each board, in the same order
+
+        The default implementation calls predict once per board, override it
+        to evaluate all boards in a single forward pass.
+        """
+        pis, vs = [], []
+        for board in boards:
+            pi, v = self.predict(board)
+            pis.append(pi)
+            vs.append(v)
+        return pis, vs
+
     def save_checkpoint(self, folder, filename):
         """
         Saves the current neural network (with its parameters) in
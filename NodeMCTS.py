@@ -0,0 +1,431 @@
+import logging
+import math
+import sys
+
+import numpy as np
+
+from MCTS import MCTS, EPS, maskPolicy, sizeOfTable
+
+log = logging.getLogger(__name__)
+
+
+class Node():
+    """
+    Search statistics of one expanded state. All arrays are aligned with
+    `actions`, the ids of the legal actions of the state, so the PUCT score of
+    every child can be computed at once.
+
+    N and Q are only allocated once an edge of the node is selected, most
+    nodes of a tree are leaves that never are. A compact node stores its
+    arrays as 32 bit integers and floats, halving their size at the cost of
+    float32 precision in Q.
+    """
+
+    __slots__ = ('actions', 'P', 'N', 'Q', 'n', 'VL', 'children', 'proofs', 'solved')
+
+    def __init__(self, actions, P, compact=False):
+        if compact:
+            actions = actions.astype(np.int32)
+            P = P.astype(np.float32)
+        self.actions = actions  # ids of the legal actions
+        self.P = P  # initial policy of each legal action (returned by neural net)
+        self.N = None  # #times each edge was visited
+        self.Q = None  # Q value of each edge (as defined in the paper)
+        self.n = 0  # #times this state was visited
+        self.VL = None  # pending (virtual) visits of each edge while a batch is being evaluated
+        self.children = {}  # index of each visited edge -> (board s, next player) it leads to
+        self.proofs = None  # proven value of each edge, nan if unknown (only with mctsSolver)
+        self.solved = None  # proven value of this state (only with mctsSolver)
+
+    def allocate(self):
+        """
+        Allocates N and Q, before the first edge of the node is selected.
+        """
+        compact = self.P.dtype == np.float32
+        self.N = np.zeros(len(self.actions), dtype=np.int32 if compact else np.int64)
+        self.Q = np.zeros(len(self.actions), dtype=self.P.dtype)
+
+    def sizeof(self):
+        """
+        Returns:
+            bytes: approximate memory held by the node and its arrays
+        """
+        arrays = (self.actions, self.P, self.N, self.Q, self.VL, self.proofs)
+        return sys.getsizeof(self) + sum(sys.getsizeof(x) for x in arrays) + sizeOfTable(self.children, values=False)
+
+
+class NodeMCTS(MCTS):
+    """
+    MCTS over a node table. Every expanded state owns a Node holding contiguous
+    numpy arrays for its legal actions, so an edge is selected with a single
+    vectorized argmax instead of a Python loop over the whole action space.
+
+    The search visits the same edges and computes the same statistics as MCTS,
+    it is selected by setting args.mctsNodeTable.
+
+    With args.mctsBatchSize = K > 1, each step descends K paths from the root,
+    using a virtual loss of weight args.mctsVirtualLoss on pending edges to
+    spread them out, evaluates the K leaves with one nnet.predict_batch call
+    and then backs up all K values.
+
+    With args.mctsCompactNodes, nodes keep their statistics in 32 bit arrays
+    (see Node), for long searches over large action spaces.
+
+    With args.mctsSolver, exact values found at terminal boards are proven up
+    the tree: a state is a proven win if one of its edges is, and is proven
+    once all its edges are. Proven states are not searched again, edges proven
+    to lose are never selected, and getActionProb stops as soon as the root
+    is proven. The solver walks the tree iteratively.
+    """
+
+    def __init__(self, game, nnet, args, evalCache=None):
+        self.game = game
+        self.nnet = nnet
+        self.args = args
+        self.evalCache = evalCache
+        self.batchSize = args.get('mctsBatchSize', 1)
+        self.virtualLoss = args.get('mctsVirtualLoss', 1.0)
+        self.compact = args.get('mctsCompactNodes', False)
+        self.nodes = {}  # stores the Node of every expanded board s
+        self.initSearch()
+        if self.solver:
+            self.iterative = True
+
+    def simulate(self, canonicalBoard, maxSims):
+        k = min(self.batchSize, maxSims)
+        if k <= 1 or self.game.stringRepresentation(canonicalBoard) not in self.nodes:
+            # an unexpanded root is evaluated on its own, all K paths would end there
+            return super().simulate(canonicalBoard, maxSims)
+        self.searchBatch(canonicalBoard, k)
+        return k
+
+    def getChildren(self, s):
+        node = self.nodes.get(s)
+        return [] if node is None else [next_s for next_s, _ in node.children.values()]
+
+    def dropState(self, s):
+        self.nodes.pop(s, None)
+        self.Es.pop(s, None)
+        self.Ts.pop(s, None)
+        self.Bs.pop(s, None)
+        self.Ds.discard(s)
+
+    def getValue(self, s):
+        node = self.nodes.get(s)
+        if node is None or not node.n:
+            return None
+        if node.solved is not None:
+            return float(node.solved)
+        return float(np.dot(node.N, node.Q) / node.n)
+
+    def getStateVisits(self, s):
+        node = self.nodes.get(s)
+        return 0 if node is None else node.n
+
+    def getTreeSize(self):
+        size = sum(sys.getsizeof(s) for s in self.Es)
+        size += sizeOfTable(self.Es) + sizeOfTable(self.Ts) + sizeOfTable(self.Bs)
+        size += sizeOfTable(self.nodes, values=False)
+        size += sum(node.sizeof() for node in self.nodes.values())
+        return {
+            'nodes': len(self.Es),
+            'expanded': len(self.nodes),
+            'bytes': size,
+        }
+
+    def addRootNoise(self, s):
+        node = self.nodes.get(s)
+        if node is None:
+            return False
+        noise = np.random.dirichlet([self.dirichletAlpha] * len(node.P))
+        node.P = ((1 - self.dirichletEpsilon) * node.P + self.dirichletEpsilon * noise).astype(node.P.dtype)
+        return True
+
+    def getLead(self, s):
+        node = self.nodes.get(s)
+        if node is None or node.N is None:
+            return 0
+        if len(node.N) == 1:
+            return int(node.N[0])
+        top = np.partition(node.N, -2)[-2:]
+        return int(top[1] - top[0])
+
+    def getVisitCounts(self, s):
+        counts = np.zeros(self.game.getActionSize(), dtype=np.int64)
+        node = self.nodes.get(s)
+        if node is not None and node.N is not None:
+            counts[node.actions] = node.N
+        return counts
+
+    def expand(self, canonicalBoard, s):
+        actions = self.game.getValidActions(canonicalBoard, 1)
+        if self.isForced(actions):
+            if self.stats is not None:
+                self.stats.count('nodes')
+            self.nodes[s] = Node(actions, np.ones(1), self.compact)
+            return None
+        pi, v = self.evaluate(canonicalBoard, s)
+        self.nodes[s] = self.makeNode(actions, pi)
+        return np.ravel(v)[0]
+
+    def makeNode(self, actions, pi):
+        """
+        Builds a Node for the legal actions from the policy pi returned by the
+        neural network, restricted to them and renormalized.
+        """
+        if self.stats is not None:
+            self.stats.count('nodes')
+        actions, Ps = self.sortByPrior(actions, maskPolicy(pi, actions))
+        return Node(actions, Ps, self.compact)
+
+    def select(self, node):
+        """
+        Returns:
+            i: index into node.actions of the edge with the highest upper
+               confidence bound
+        """
+        if node.N is None:
+            node.allocate()
+        N, Q, P, n = node.N, node.Q, node.P, node.n
+        VL, proofs = node.VL, node.proofs
+        if self.widening:
+            # only the k edges with the highest prior are considered
+            k = self.getWidth(n)
+            N, Q, P = N[:k], Q[:k], P[:k]
+            VL = None if VL is None else VL[:k]
+            proofs = None if proofs is None else proofs[:k]
+        if VL is not None:
+            # pending visits count as visits that lost virtualLoss each
+            Q = (N * Q - self.virtualLoss * VL) / np.maximum(N + VL, 1)
+            N = N + VL
+            n = n + int(node.VL.sum())
+        if proofs is not None:
+            # edges proven to lose are never selected again
+            Q = np.where(proofs <= -1, -np.inf, Q)
+            N = np.where(proofs <= -1, 1, N)
+
+        cpuct = self.args.cpuct
+        u = np.where(N > 0,
+                     Q + cpuct * P * math.sqrt(n) / (1 + N),
+                     cpuct * P * math.sqrt(n + EPS))  # Q = 0 ?
+        return int(np.argmax(u))
+
+    def search(self, canonicalBoard, s=None, depth=0):
+        """
+        This function performs one iteration of MCTS, see MCTS.search.
+
+        Returns:
+            v: the value of the current canonicalBoard
+        """
+        if s is None:
+            s = self.game.stringRepresentation(canonicalBoard)
+        if self.maxNodes:
+            self.Ts[s] = self.tick
+
+        if s not in self.Es:
+            self.Es[s] = self.game.getGameEnded(canonicalBoard, 1)
+        # terminal node
+        if self.Es[s] != 0:
+            if self.stats is not None:
+                self.stats.count('terminalHits')
+                self.stats.addDepth(depth)
+            return self.Es[s]
+
+        if self.cycleDetection:
+            if depth == 0:
+                self.pathKeys = set()
+            if self.closesCycle(canonicalBoard, self.pathKeys):
+                if self.stats is not None:
+                    self.stats.addDepth(depth)
+                return 0
+
+        node = self.nodes.get(s)
+        # leaf node
+        if node is None:
+            v = self.expand(canonicalBoard, s)
+            if v is not None:
+                if self.stats is not None:
+                    self.stats.addDepth(depth)
+                return v
+            node = self.nodes[s]
+
+        i = self.select(node)
+        next_board, next_s, next_player = self.getTransition(canonicalBoard, int(node.actions[i]), node.children, i)
+
+        v_child = self.search(next_board, next_s, depth + 1)
+        v = v_child if next_player == 1 else -v_child
+
+        node.Q[i] = (node.N[i] * node.Q[i] + v) / (node.N[i] + 1)
+        node.N[i] += 1
+        node.n += 1
+        return v
+
+    def searchIterative(self, canonicalBoard):
+        """
+        Performs the same iteration of MCTS as search, see
+        MCTS.searchIterative.
+        """
+        path, board, s, actions = self.descend(canonicalBoard)
+        v = self.getExactValue(s)
+        if v is not None:
+            return self.backup(path, v, v if self.solver and s is not None else None)
+
+        pi, v = self.evaluate(board, s)
+        self.nodes[s] = self.makeNode(actions, pi)
+        return self.backup(path, np.ravel(v)[0])
+
+    def descend(self, canonicalBoard):
+        """
+        Follows the edges with the highest upper confidence bound from
+        canonicalBoard until a terminal, proven or unexpanded board is reached.
+        Unexpanded boards with a single valid move are expanded on the way
+        if forced moves are skipped.
+
+        Returns:
+            path: list of (node, i, flip) for every traversed edge, flip is
+                  True if the player to move changed along the edge
+            leafBoard: the canonical board at the end of the path
+            s: the string representation of leafBoard, None if leafBoard
+               repeats a position of the path (with mctsCycleDetection)
+            actions: the legal actions of leafBoard (None if it is terminal,
+                     proven or repeated)
+        """
+        path = []
+        keys = set()  # repetition keys of the boards on path (only with mctsCycleDetection)
+        board = canonicalBoard
+        s = self.game.stringRepresentation(board)
+        while True:
+            if self.maxNodes:
+                self.Ts[s] = self.tick
+            if s not in self.Es:
+                self.Es[s] = self.game.getGameEnded(board, 1)
+            if self.Es[s] != 0:
+                if self.stats is not None:
+                    self.stats.count('terminalHits')
+                    self.stats.addDepth(len(path))
+                return path, board, s, None
+            if self.cycleDetection and self.closesCycle(board, keys):
+                if self.stats is not None:
+                    self.stats.addDepth(len(path))
+                return path, board, None, None
+            node = self.nodes.get(s)
+            if node is None:
+                actions = self.game.getValidActions(board, 1)
+                if not self.isForced(actions):
+                    if self.stats is not None:
+                        self.stats.addDepth(len(path))
+                    return path, board, s, actions
+                if self.stats is not None:
+                    self.stats.count('nodes')
+                node = self.nodes[s] = Node(actions, np.ones(1), self.compact)
+            elif node.solved is not None:
+                if self.stats is not None:
+                    self.stats.addDepth(len(path))
+                return path, board, s, None
+
+            i = self.select(node)
+            board, s, next_player = self.getTransition(board, int(node.actions[i]), node.children, i)
+            path.append((node, i, next_player != 1))
+
+    def backup(self, path, v, proof=None):
+        """
+        Propagates the value v of the board at the end of path up to the root,
+        updating Q, N and n of every traversed edge. If proof is given, it is
+        the exact value of that board and is proven up the path for as long as
+        the states along it become proven too.
+
+        Returns:
+            v: the value of the board at the start of path
+        """
+        for node, i, flip in reversed(path):
+            if flip:
+                v = -v
+                if proof is not None:
+                    proof = -proof
+            node.Q[i] = (node.N[i] * node.Q[i] + v) / (node.N[i] + 1)
+            node.N[i] += 1
+            node.n += 1
+            if proof is not None:
+                proof = self.prove(node, i, proof)
+        return v
+
+    def prove(self, node, i, proof):
+        """
+        Records that edge i of node has the exact value proof.
+
+        Returns:
+            solved: the proven value of node, or None if it is not proven yet
+        """
+        if node.proofs is None:
+            node.proofs = np.full(len(node.actions), np.nan)
+        node.proofs[i] = proof
+        if proof >= 1:
+            node.solved = proof
+        elif not np.isnan(node.proofs).any():
+            node.solved = node.proofs.max()
+        return node.solved
+
+    def getExactValue(self, s):
+        """
+        Returns:
+            v: the value of board s if it is terminal or proven, else None. A
+               repeated board (s is None, see descend) is a draw.
+        """
+        if s is None:
+            return 0
+        if self.Es[s] != 0:
+            return self.Es[s]
+        node = self.nodes.get(s)
+        return None if node is None else node.solved
+
+    def getProvenAction(self, s):
+        node = self.nodes.get(s)
+        if node is None or node.solved is None:
+            return None
+        return int(node.actions[np.nanargmax(node.proofs)])
+
+    def addVirtualLoss(self, path, count):
+        for node, i, _ in path:
+            if node.VL is None:
+                node.VL = np.zeros(len(node.actions), dtype=np.int64)
+            node.VL[i] += count
+            if not node.VL.any():
+                node.VL = None
+
+    def searchBatch(self, canonicalBoard, k):
+        """
+        Performs k simulations from canonicalBoard, evaluating all their leaves
+        with a single call to nnet.predict_batch. Terminal leaves are backed up
+        right away, paths that end on a leaf already in the batch share its
+        evaluation and leaves found in evalCache are not sent to the network.
+        """
+        leaves = {}  # s -> (leafBoard, actions, paths ending at s)
+        for _ in range(k):
+            path, board, s, actions = self.descend(canonicalBoard)
+            v = self.getExactValue(s)
+            if v is not None:
+                self.backup(path, v, v if self.solver and s is not None else None)
+                continue
+            self.addVirtualLoss(path, 1)
+            leaves.setdefault(s, (board, actions, []))[2].append(path)
+
+        evaluations = {}  # s -> (pi, v)
+        if self.evalCache is not None:
+            for s in leaves:
+                evaluation = self.evalCache.get(s)
+                if evaluation is not None:
+                    evaluations[s] = evaluation
+        missing = [s for s in leaves if s not in evaluations]
+        if missing:
+            pis, vs = self.nnet.predict_batch([leaves[s][0] for s in missing])
+            for s, pi, v in zip(missing, pis, vs):
+                evaluations[s] = (pi, v)
+                if self.evalCache is not None:
+                    self.evalCache.put(s, pi, v)
+
+        for s, (pi, v) in evaluations.items():
+            _, actions, paths = leaves[s]
+            self.nodes[s] = self.makeNode(actions, pi)
+            for path in paths:
+                self.addVirtualLoss(path, -1)
+                self.backup(path, np.ravel(v)[0])
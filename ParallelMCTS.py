@@ -0,0 +1,102 @@
+import logging
+import multiprocessing
+
+import numpy as np
+
+from MCTS import MCTS, countsToPolicy
+from utils import *
+
+log = logging.getLogger(__name__)
+
+
+def runWorker(conn, game, nnet, args, checkpoint, seed):
+    """
+    Body of a worker process: builds its own network and MCTS, then answers
+    every board received on conn with the policy of a search from it, its root
+    visit counts (see MCTS.getRootCounts) and the number of simulations that
+    were run, until it receives None.
+    """
+    np.random.seed(seed)
+    if checkpoint is not None:
+        # nnet is the network class, its parameters are loaded from disk
+        nnet = nnet(game)
+        nnet.load_checkpoint(*checkpoint)
+    mcts = MCTS(game, nnet, args)
+    while True:
+        board = conn.recv()
+        if board is None:
+            break
+        pi = mcts.getActionProb(board, temp=1)
+        conn.send((pi, mcts.getRootCounts(board), mcts.lastSearch['sims']))
+    conn.close()
+
+
+class ParallelMCTS():
+    """
+    Root-parallel MCTS: numWorkers processes, each with its own MCTS and copy
+    of the network, search the same root independently and their root visit
+    counts are summed into the policy. It has the getActionProb of MCTS, so it
+    can stand in for it in the players of pit.py and Arena.
+
+    The searches of the workers differ through the Dirichlet noise mixed into
+    their root priors, args.mctsDirichletEpsilon defaults to 0.25 here.
+
+    If checkpoint, a (folder, filename) tuple, is given, every worker creates
+    a network of the class of nnet and loads it from there. Otherwise nnet is
+    pickled and sent to the workers.
+    """
+
+    def __init__(self, game, nnet, args, numWorkers, checkpoint=None):
+        self.game = game
+        self.args = dotdict(dict({'mctsDirichletEpsilon': 0.25}, **args))
+        self.conns = []
+        self.workers = []
+        seeds = np.random.randint(2 ** 31, size=numWorkers)
+        for seed in seeds:
+            conn, workerConn = multiprocessing.Pipe()
+            worker = multiprocessing.Process(
+                target=runWorker, daemon=True,
+                args=(workerConn, game, nnet.__class__ if checkpoint else nnet, self.args, checkpoint, seed))
+            worker.start()
+            workerConn.close()
+            self.conns.append(conn)
+            self.workers.append(worker)
+        self.lastSearch = None  # {'sims'} summed over the workers for the last getActionProb call
+
+    def getActionProb(self, canonicalBoard, temp=1):
+        """
+        Searches canonicalBoard in every worker.
+
+        Returns:
+            probs: a policy vector where the probability of the ith action is
+                   proportional to the summed visit counts of the workers
+                   raised to the power 1./temp, or the policy of a worker
+                   whose root was forced or proven
+        """
+        for conn in self.conns:
+            conn.send(canonicalBoard)
+        counts = np.zeros(self.game.getActionSize(), dtype=np.int64)
+        decided = None
+        sims = 0
+        for conn in self.conns:
+            pi, workerCounts, n = conn.recv()
+            if workerCounts is None:
+                decided = pi
+            else:
+                counts += workerCounts
+            sims += n
+        self.lastSearch = {'sims': sims}
+        if decided is not None:
+            return decided
+        return countsToPolicy(counts, temp)
+
+    def close(self):
+        """
+        Stops the worker processes.
+        """
+        for conn in self.conns:
+            conn.send(None)
+            conn.close()
+        for worker in self.workers:
+            worker.join()
+        self.conns, self.workers = [], []
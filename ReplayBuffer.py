@@ -0,0 +1,204 @@
+import logging
+from collections import deque
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+class ReplayBuffer():
+    """
+    The training examples (board, pi, v) of the latest self-play iterations,
+    stored in typed numpy arrays used as a ring buffer: boards, policies,
+    values and the iteration each example was played in.
+
+    Adding an example is amortized O(1), the oldest ones are overwritten once maxSize
+    examples are stored (with a warning the first time), and the examples of
+    the oldest iteration are dropped in O(1) by moving the start of the ring.
+    The arrays grow by doubling up to maxSize, so a large maxSize only costs
+    memory once it is used.
+
+    sample draws a random batch as arrays with vectorized indexing. The buffer
+    also behaves as a read-only sequence of (board, pi, v) tuples, so code
+    written for a list of examples keeps working.
+    """
+
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self.boards = None  # allocated by the first add, once the shapes are known
+        self.pis = None
+        self.vs = None
+        self.iterations = None
+        self.start = 0  # index of the oldest example
+        self.size = 0  # #examples stored
+        self.counts = deque()  # [iteration, #examples stored] of every iteration, oldest first
+        self.overwritten = False  # whether examples were overwritten yet, they are only reported once
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        if not -self.size <= i < self.size:
+            raise IndexError('replay buffer index out of range')
+        j = (self.start + i % self.size) % len(self.vs)
+        return self.boards[j], self.pis[j], self.vs[j]
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield self[i]
+
+    def allocate(self, board, pi, capacity):
+        """
+        Allocates (or grows) the arrays to hold capacity examples shaped like
+        board and pi, keeping the stored ones at the start.
+        """
+        board, pi = np.asarray(board), np.asarray(pi)
+        boards = np.empty((capacity,) + board.shape, dtype=board.dtype)
+        pis = np.empty((capacity,) + pi.shape, dtype=np.float32)
+        vs = np.empty(capacity, dtype=np.float64)  # draws are worth +-1e-4
+        iterations = np.empty(capacity, dtype=np.int64)
+        if self.size:
+            ids = self.getIndices()
+            boards[:self.size] = self.boards[ids]
+            pis[:self.size] = self.pis[ids]
+            vs[:self.size] = self.vs[ids]
+            iterations[:self.size] = self.iterations[ids]
+        self.boards, self.pis, self.vs, self.iterations = boards, pis, vs, iterations
+        self.start = 0
+
+    def add(self, examples, iteration):
+        """
+        Appends examples, an iterable of (board, pi, v), played in iteration
+        (which must not be older than the ones already stored), overwriting
+        the oldest examples if the buffer is full.
+        """
+        examples = list(examples)
+        if examples:
+            boards, pis, vs = zip(*examples)
+            self.addArrays(np.asarray(boards), np.asarray(pis), np.asarray(vs), iteration)
+
+    def addArrays(self, boards, pis, vs, iteration):
+        """
+        Appends the examples held by the arrays boards, pis and vs, see add.
+        """
+        n = min(len(vs), self.maxSize)
+        boards, pis, vs = boards[len(vs) - n:], pis[len(vs) - n:], vs[len(vs) - n:]
+        if self.vs is None or (self.size + n > len(self.vs) and len(self.vs) < self.maxSize):
+            self.allocate(boards[0], pis[0], min(self.maxSize, max(1024, 2 * (self.size + n))))
+        if self.size + n > len(self.vs):
+            # full, the oldest examples are overwritten
+            if not self.overwritten:
+                log.warning(f'Replay buffer full ({self.maxSize} examples), overwriting the oldest examples. '
+                            f'Raise replayBufferSize to keep them.')
+                self.overwritten = True
+            self.dropOldest(self.size + n - len(self.vs))
+        ids = (self.start + self.size + np.arange(n)) % len(self.vs)
+        self.boards[ids] = boards
+        self.pis[ids] = pis
+        self.vs[ids] = vs
+        self.iterations[ids] = iteration
+        self.size += n
+        if self.counts and self.counts[-1][0] == iteration:
+            self.counts[-1][1] += n
+        else:
+            self.counts.append([iteration, n])
+
+    def dropOldest(self, n):
+        """
+        Forgets the n oldest examples.
+        """
+        self.start = (self.start + n) % len(self.vs)
+        self.size -= n
+        while n:
+            k = min(n, self.counts[0][1])
+            self.counts[0][1] -= k
+            n -= k
+            if not self.counts[0][1]:
+                self.counts.popleft()
+
+    def getIterations(self):
+        """
+        Returns:
+            iterations: the iterations with examples in the buffer, oldest first
+        """
+        return [iteration for iteration, _ in self.counts]
+
+    def dropOldestIteration(self):
+        """
+        Forgets the examples of the oldest iteration.
+        """
+        self.dropOldest(self.counts[0][1])
+
+    def getIteration(self, iteration):
+        """
+        Returns:
+            boards, pis, vs: arrays with the stored examples of iteration
+        """
+        offset = 0
+        for it, n in self.counts:
+            if it == iteration:
+                ids = (self.start + offset + np.arange(n)) % len(self.vs)
+                return self.boards[ids], self.pis[ids], self.vs[ids]
+            offset += n
+        raise KeyError(f'No examples of iteration {iteration} in the replay buffer')
+
+    def getIndices(self):
+        """
+        Returns:
+            ids: the array indices of the stored examples, oldest first
+        """
+        return (self.start + np.arange(self.size)) % len(self.vs)
+
+    def sample(self, batchSize):
+        """
+        Returns:
+            boards, pis, vs: arrays with batchSize examples drawn uniformly at
+                             random, with replacement
+        """
+        ids = (self.start + np.random.randint(self.size, size=batchSize)) % len(self.vs)
+        return self.boards[ids], self.pis[ids], self.vs[ids]
+
+    def toArrays(self):
+        """
+        Returns:
+            boards, pis, vs: arrays with all the stored examples, oldest first
+        """
+        ids = self.getIndices()
+        return self.boards[ids], self.pis[ids], self.vs[ids]
+
+
+def sampleBatch(examples, batchSize):
+    """
+    Returns:
+        boards, pis, vs: batchSize examples drawn at random from examples, a
+                         ReplayBuffer or a list of (board, pi, v)
+    """
+    if hasattr(examples, 'sample'):
+        return examples.sample(batchSize)
+    sample_ids = np.random.randint(len(examples), size=batchSize)
+    return list(zip(*[examples[i] for i in sample_ids]))
+
+
+def toArrays(examples):
+    """
+    Returns:
+        boards, pis, vs: all of examples, a ReplayBuffer or a list of
+                         (board, pi, v), as arrays
+    """
+    if hasattr(examples, 'toArrays'):
+        return examples.toArrays()
+    boards, pis, vs = list(zip(*examples))
+    return np.asarray(boards), np.asarray(pis), np.asarray(vs)
+
+
+def fitExamples(model, examples, batchSize, epochs):
+    """
+    Fits the Keras model to examples, a list of (board, pi, v), a
+    ReplayBuffer or a ShardDataset. The batches of a ShardDataset are streamed
+    from disk instead of loading all examples into memory.
+    """
+    if hasattr(examples, 'generate'):
+        model.fit(examples.generate(batchSize), steps_per_epoch=max(1, len(examples) // batchSize), epochs=epochs)
+    else:
+        boards, pis, vs = toArrays(examples)
+        model.fit(x=boards, y=[pis, vs], batch_size=batchSize, epochs=epochs)
@@ -0,0 +1,113 @@
+import functools
+import json
+import time
+
+
+class SearchStats():
+    """
+    Counters and per-phase timers of an MCTS, enabled with args.mctsStats.
+
+    Time is measured by wrapping the methods of the game, the neural network
+    and the selection step of the search (see wrap and timed), so an MCTS
+    without stats runs the original methods and pays nothing for them.
+    """
+
+    GAME_PHASES = ('getNextState', 'getValidMoves', 'getValidActions', 'getGameEnded', 'stringRepresentation',
+                   'getCanonicalForm', 'getRepetitionKey')
+    NNET_PHASES = {'predict': 'inference', 'predict_batch': 'inference'}
+
+    def __init__(self):
+        self.times = {}  # phase -> seconds spent in it
+        self.calls = {}  # phase -> #calls
+        self.reset()
+
+    def reset(self):
+        self.counters = {
+            'searches': 0,  # #getActionProb calls
+            'sims': 0,  # #simulations run
+            'nodes': 0,  # #states expanded
+            'terminalHits': 0,  # #simulations that ended on a terminal board
+            'cacheHits': 0,  # #edges traversed through the transition cache
+            'cycleHits': 0,  # #simulations that ended on a position repeated on their path
+        }
+        # zeroed in place, the functions returned by timed keep adding to these dicts
+        self.times.update(dict.fromkeys(self.times, 0.))
+        self.calls.update(dict.fromkeys(self.calls, 0))
+        self.depths = 0  # sum of the depths of all simulations
+        self.maxDepth = 0
+
+    def count(self, counter, n=1):
+        self.counters[counter] += n
+
+    def addDepth(self, depth):
+        """
+        Records a simulation that reached a leaf or terminal board depth edges
+        below the root.
+        """
+        self.depths += depth
+        if depth > self.maxDepth:
+            self.maxDepth = depth
+
+    def timed(self, phase, f):
+        """
+        Returns:
+            g: a function that calls f and adds its running time to phase
+        """
+        times, calls = self.times, self.calls
+        times.setdefault(phase, 0.)
+        calls.setdefault(phase, 0)
+
+        @functools.wraps(f)
+        def g(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                times[phase] += time.perf_counter() - start
+                calls[phase] += 1
+        return g
+
+    def wrap(self, obj, phases):
+        """
+        Returns:
+            proxy: an object that forwards every attribute to obj, with the
+                   methods named in phases timed. phases is a list of method
+                   names or a dict from method name to phase.
+        """
+        if not isinstance(phases, dict):
+            phases = {name: name for name in phases}
+        return TimedProxy(obj, {name: self.timed(phase, getattr(obj, name))
+                                for name, phase in phases.items() if hasattr(obj, name)})
+
+    def snapshot(self):
+        """
+        Returns:
+            stats: a dict with the counters, the number of network calls
+                   ('nnetCalls'), the maximum and mean depth of the
+                   simulations, and the seconds spent ('time') and calls made
+                   ('calls') in every phase
+        """
+        sims = self.counters['sims']
+        stats = dict(self.counters)
+        stats['nnetCalls'] = self.calls.get('inference', 0)
+        stats['maxDepth'] = self.maxDepth
+        stats['meanDepth'] = self.depths / sims if sims else 0.
+        stats['time'] = dict(self.times)
+        stats['calls'] = dict(self.calls)
+        return stats
+
+    def toJSON(self):
+        return json.dumps(self.snapshot(), sort_keys=True)
+
+
+class TimedProxy():
+    """
+    Stands in for a game or a neural network, see SearchStats.wrap.
+    """
+
+    def __init__(self, obj, methods):
+        self.__dict__.update(methods)
+        self._obj = obj
+
+    def __getattr__(self, name):
+        return getattr(self._obj, name)
@@ -0,0 +1,177 @@
+"""
+Benchmarks for the MCTS variants.
+
+The searches are driven by RandomNet, which returns a fixed pseudo-random policy
+and value for every board, so the numbers measure the cost of the search itself
+and do not depend on an ML framework. Run one benchmark with e.g.
+
+    python benchmark_mcts.py iterative
+"""
+
+import argparse
+import logging
+import time
+import zlib
+
+import numpy as np
+
+from Coach import Coach
+from MCTS import MCTS
+from NeuralNet import NeuralNet
+from ParallelMCTS import ParallelMCTS
+from utils import *
+
+from gobang.GobangGame import GobangGame
+from othello.OthelloGame import OthelloGame
+from tictacshoot.CustomTicTacToeGame import CustomTicTacToeGame
+
+log = logging.getLogger(__name__)
+
+GAMES = {
+    'tictacshoot': lambda: CustomTicTacToeGame(),
+    'othello': lambda: OthelloGame(6),
+    'gobang': lambda: GobangGame(15),
+}
+
+
+class RandomNet(NeuralNet):
+    """Returns a fixed pseudo-random policy and value for every board."""
+
+    def __init__(self, game):
+        self.action_size = game.getActionSize()
+
+    def predict(self, board):
+        rng = np.random.RandomState(zlib.crc32(np.ascontiguousarray(board).tobytes()))
+        return rng.dirichlet(np.ones(self.action_size)), rng.uniform(-1, 1)
+
+
+def play(game, mcts, moves):
+    """
+    Plays up to `moves` moves with the most visited action of each search.
+
+    Returns:
+        seconds: time spent in getActionProb
+        policies: the policy returned by every search
+    """
+    board, player = game.getInitBoard(), 1
+    seconds, policies = 0., []
+    for _ in range(moves):
+        if game.getGameEnded(board, player) != 0:
+            break
+        canonicalBoard = game.getCanonicalForm(board, player)
+        start = time.perf_counter()
+        pi = mcts.getActionProb(canonicalBoard, temp=1)
+        seconds += time.perf_counter() - start
+        policies.append(pi)
+        board, player = game.getNextState(board, player, int(np.argmax(pi)))
+    return seconds, policies
+
+
+def compare(options, variants, layouts=(('dict', False), ('nodetable', True))):
+    """
+    Times the same games with every variant, a dict of args added to the
+    baseline args, and checks that the searches returned the same policies.
+    """
+    labels = [label for label, _ in variants]
+    print(f'{"game":<12} {"layout":<10} ' + ' '.join(f'{label:>12}' for label in labels) + '  same')
+    for name in options.games:
+        game = GAMES[name]()
+        for layout, nodeTable in layouts:
+            results = []
+            for _, extra in variants:
+                args = dotdict(dict({'numMCTSSims': options.sims, 'cpuct': 1.0, 'mctsNodeTable': nodeTable}, **extra))
+                results.append(play(game, MCTS(game, RandomNet(game), args), options.moves))
+            policies = [p for _, p in results]
+            same = all(len(p) == len(policies[0]) and all(np.array_equal(x, y) for x, y in zip(p, policies[0]))
+                       for p in policies)
+            print(f'{name:<12} {layout:<10} ' + ' '.join(f'{seconds:>11.2f}s' for seconds, _ in results) + f'  {same}')
+
+
+def benchmark_iterative(options):
+    """Recursive MCTS.search against the explicit-stack searchIterative."""
+    compare(options, [('recursive', {}), ('iterative', {'mctsIterative': True})])
+
+
+def benchmark_transitions(options):
+    """Recomputing every traversed edge against the transition cache."""
+    compare(options, [('uncached', {}), ('cached', {'mctsTransitionCache': 100000})])
+
+
+def benchmark_memory(options):
+    """
+    Size of the tree after a game searched by a single MCTS, for the dict
+    layout, the node table and the node table with compact nodes.
+    """
+    layouts = [('dict', {}), ('nodetable', {'mctsNodeTable': True}),
+               ('compact', {'mctsNodeTable': True, 'mctsCompactNodes': True})]
+    print(f'{"game":<12} {"layout":<10} {"nodes":>8} {"expanded":>9} {"MB":>8} {"bytes/exp.":>11}')
+    for name in options.games:
+        game = GAMES[name]()
+        for layout, extra in layouts:
+            args = dotdict(dict({'numMCTSSims': options.sims, 'cpuct': 1.0}, **extra))
+            mcts = MCTS(game, RandomNet(game), args)
+            play(game, mcts, options.moves)
+            size = mcts.getTreeSize()
+            print(f'{name:<12} {layout:<10} {size["nodes"]:>8} {size["expanded"]:>9} {size["bytes"] / 2 ** 20:>8.2f}'
+                  f' {size["bytes"] // max(size["expanded"], 1):>11}')
+
+
+def benchmark_parallel(options):
+    """
+    Root-parallel MCTS with 1, 2, 4 and 8 worker processes, each running
+    options.sims simulations per move: simulations per second over a game.
+    """
+    print(f'{"game":<12} {"workers":>7} {"seconds":>8} {"sims/s":>8} {"speedup":>8}')
+    for name in options.games:
+        game = GAMES[name]()
+        base = None
+        for workers in (1, 2, 4, 8):
+            args = dotdict({'numMCTSSims': options.sims, 'cpuct': 1.0})
+            mcts = ParallelMCTS(game, RandomNet(game), args, workers)
+            seconds, policies = play(game, mcts, options.moves)
+            mcts.close()
+            rate = workers * options.sims * len(policies) / seconds
+            base = base or rate
+            print(f'{name:<12} {workers:>7} {seconds:>8.2f} {rate:>8.0f} {rate / base:>7.2f}x')
+
+
+def benchmark_playout(options):
+    """
+    Self-play with Coach.executeEpisode, every move searched with
+    options.sims simulations against playout cap randomization: a quarter of
+    the moves searched in full and kept, the others with options.sims // 5.
+    """
+    variants = [('full', {}), ('capped', {'playoutCapFraction': 0.25, 'numMCTSSimsFast': max(1, options.sims // 5)})]
+    print(f'{"game":<12} {"self-play":<10} {"games/h":>9} {"examples/h":>11}')
+    for name in options.games:
+        game = GAMES[name]()
+        for label, extra in variants:
+            args = dotdict(dict({'numMCTSSims': options.sims, 'cpuct': 1.0, 'tempThreshold': 15}, **extra))
+            coach = Coach(game, RandomNet(game), args)
+            start = time.perf_counter()
+            examples = 0
+            for _ in range(options.games_per_run):
+                examples += len(coach.executeEpisode())
+            hours = (time.perf_counter() - start) / 3600
+            print(f'{name:<12} {label:<10} {options.games_per_run / hours:>9.0f} {examples / hours:>11.0f}')
+
+
+BENCHMARKS = {
+    'iterative': benchmark_iterative,
+    'memory': benchmark_memory,
+    'parallel': benchmark_parallel,
+    'playout': benchmark_playout,
+    'transitions': benchmark_transitions,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--games', nargs='+', choices=sorted(GAMES), default=sorted(GAMES))
+    parser.add_argument('--sims', type=int, default=100, help='simulations per move')
+    parser.add_argument('--moves', type=int, default=20, help='moves per game')
+    parser.add_argument('--games-per-run', type=int, default=5, help='self-play games per variant')
+    options = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    BENCHMARKS[options.benchmark](options)
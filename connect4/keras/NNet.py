@@ -9,6 +9,7 @@ import sys
 sys.path.append('../..')
 from utils import *
 from NeuralNet import NeuralNet
+from ReplayBuffer import fitExamples
 
 import logging
 import coloredlogs
@@ -37,13 +38,10 @@ class NNetWrapper(NeuralNet):
 
     def train(self, examples):
         """
-        examples: list of examples, each example is of form (board, pi, v)
+        examples: list of examples, each example is of form (board, pi, v), or
+                  a ReplayBuffer or ShardDataset
         """
-        input_boards, target_pis, target_vs = list(zip(*examples))
-        input_boards = np.asarray(input_boards)
-        target_pis = np.asarray(target_pis)
-        target_vs = np.asarray(target_vs)
-        self.nnet.model.fit(x = input_boards, y = [target_pis, target_vs], batch_size = args.batch_size, epochs = args.epochs)
+        fitExamples(self.nnet.model, examples, args.batch_size, args.epochs)
 
     def predict(self, board):
         """
@@ -61,6 +59,13 @@ class NNetWrapper(NeuralNet):
         #print('PREDICTION TIME TAKEN : {0:03f}'.format(time.time()-start))
         return pi[0], v[0]
 
+    def predict_batch(self, boards):
+        """
+        boards: list of np arrays with boards
+        """
+        pi, v = self.nnet.model.predict(np.array(boards), verbose=False)
+        return pi, v
+
     def save_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar'):
         # change extension
         filename = filename.split(".")[0] + ".h5"
@@ -4,6 +4,7 @@ import os
 sys.path.append('..')
 from utils import dotdict
 from NeuralNet import NeuralNet
+from ReplayBuffer import toArrays
 
 from .DotsAndBoxesNNet import DotsAndBoxesNNet as onnet
 
@@ -42,9 +43,10 @@ class NNetWrapper(NeuralNet):
 
     def train(self, examples):
         """
-        examples: list of examples, each example is of form (board, pi, v)
+        examples: list of examples, each example is of form (board, pi, v), or
+                  a ReplayBuffer
         """
-        input_boards, target_pis, target_vs = list(zip(*examples))
+        input_boards, target_pis, target_vs = toArrays(examples)
         input_boards = np.asarray(input_boards)
 
         normalize_score(input_boards)
@@ -66,6 +68,16 @@ class NNetWrapper(NeuralNet):
 
         return pi[0], v[0]
 
+    def predict_batch(self, boards):
+        """
+        boards: list of np arrays with boards
+        """
+        boards = np.array(boards)
+        normalize_score(boards)
+
+        pi, v = self.nnet.model.predict(boards, verbose=False)
+        return pi, v
+
     def save_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar'):
         # change extension
         filename = filename.split(".")[0] + ".h5"
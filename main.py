@@ -2,6 +2,7 @@
 
 import logging
 
+from AsyncCoach import AsyncCoach
 from Coach import Coach
 from utils import *
 
@@ -17,17 +18,51 @@ log = logging.getLogger(__name__)
 args = dotdict({
     'numIters': 1000,
     'numEps': 100,              # Number of complete self-play games to simulate during a new iteration.
+    'asyncPipeline': False,     # Self-play, train and gate at the same time, in separate processes (AsyncCoach.py).
+    'numSelfPlayWorkers': 1,    # Processes playing the self-play games of an iteration (1 = all in this process).
+    'numParallelGames': 1,      # Self-play games played together, batching their network calls (1 = one at a time).
     'tempThreshold': 15,        #
     'updateThreshold': 0.6,     # During arena playoff, new neural net will be accepted if threshold or more of games are won.
     'maxlenOfQueue': 200000,    # Number of game examples to train the neural networks.
     'numMCTSSims': 25,          # Number of MCTS simulations per move.
+    'playoutCapFraction': 1,    # Fraction of self-play moves searched with numMCTSSims and kept as examples.
+    'numMCTSSimsFast': 5,       # Simulations of the other self-play moves, which are not kept.
+    'resignThreshold': -1,      # Resign a self-play game when the root value stays below this (-1 = never).
+    'resignMoves': 3,           # ... for this many consecutive moves of the player.
+    'noResignFraction': 0.1,    # Fraction of self-play games played to the end to check the resignations.
+    'repetitionLimit': 3,       # Draw self-play and arena games once a position occurs this many times (0 = never).
     'arenaCompare': 40,         # Number of games to play during arena play to determine if new net will be accepted.
     'cpuct': 1,
+    'mctsNodeTable': False,     # Keep the MCTS statistics of each state in numpy arrays (NodeMCTS.py).
+    'mctsBatchSize': 1,         # Leaves evaluated per batched network call (needs mctsNodeTable).
+    'mctsVirtualLoss': 1.0,     # Virtual loss applied to edges with a pending evaluation.
+    'mctsReuseTree': False,     # Keep the subtree of the new root between moves, drop unreachable states.
+    'mctsIterative': False,     # Walk the tree with an explicit path instead of recursing once per ply.
+    'mctsMaxNodes': 0,          # Evict boards from the search tree above this many (0 = unbounded).
+    'mctsEvictionPolicy': 'lru',  # 'lru' (least recently visited) or 'visits' (least visited) boards go first.
+    'mctsTransitionCache': 100000,  # Canonical boards cached for edges already traversed (0 = off).
+    'mctsForcedMoves': True,    # Walk through boards with a single valid move without evaluating them.
+    'mctsSkipForcedRoot': True,  # Don't search at all when the root has a single valid move.
+    'mctsCompactNodes': False,  # Keep node statistics in 32 bit arrays to halve their memory (needs mctsNodeTable).
+    'mctsSolver': False,        # Prove wins/losses/draws up the tree and stop searching proven states (needs mctsNodeTable).
+    'mctsTimeBudget': 0,        # Stop a search after this many seconds, even before numMCTSSims (0 = no deadline).
+    'mctsEarlyStop': False,     # Stop a search once the most visited root action cannot be overtaken.
+    'mctsDirichletEpsilon': 0,  # Weight of the Dirichlet noise mixed into the root priors (0 = off).
+    'mctsDirichletAlpha': 0.3,  # Concentration of that noise.
+    'mctsWidening': 0,          # Progressive widening: consider the c*(n+1)**exponent best prior moves (0 = off).
+    'mctsWideningExponent': 0.5,  # Growth of the number of moves considered with the visits of a board.
+    'mctsCycleDetection': True,  # End simulations that repeat a position of their path as a draw.
+    'mctsSymmetry': False,      # Store one node per symmetry class of boards (Game.getCanonicalSymmetry).
+    'mctsStats': False,         # Collect search counters and per-phase timers, logged at debug level.
+    'evalCacheSize': 100000,    # Network evaluations shared by the self-play searches of an iteration (0 = off).
 
     'checkpoint': './temp/',
     'load_model': False,
     'load_folder_file': ('/dev/models/8x8x25','best.pth.tar'),
     'numItersForTrainExamplesHistory': 20,
+    'replayBufferSize': 0,      # Training examples kept at most, the oldest are overwritten first (0 = the whole history).
+    'streamTrainExamples': False,  # Train on batches read from the example shards on disk instead of memory.
+    'prefetchBatches': 0,       # Batches read ahead by a background thread when streaming (0 = read on demand).
 })
 
 def main():
@@ -43,7 +78,7 @@ def main():
     else:
         log.warning('Not loading a checkpoint.')
 
-    c = Coach(g, nnet, args)
+    c = (AsyncCoach if args.asyncPipeline else Coach)(g, nnet, args)
     if args.load_model:
         log.info("Loading trainExamples from file...")
         c.loadTrainExamples()
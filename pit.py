@@ -2,6 +2,7 @@
 
 import Arena
 from MCTS import MCTS
+from ParallelMCTS import ParallelMCTS
 from utils import *
 import numpy as np
 
@@ -15,6 +16,8 @@ any agent for the custom Tic-Tac-Toe game.
 USE_PYTORCH = True
 # Set to True to play against the AI, False for AI vs. AI
 HUMAN_VS_CPU = True
+# Number of processes searching every move of the AI in parallel (1 = single MCTS)
+NUM_WORKERS = 1
 
 # --- Game and Player Imports ---
 from tictacshoot.CustomTicTacToeGame import CustomTicTacToeGame as Game
@@ -44,14 +47,18 @@ if USE_PYTORCH:
     # NOTE: You must have a trained model for this to work.
     # To play against a random opponent, comment out n1.load_checkpoint and set player2 = rp
     # To train a model, run main.py.
-    n1.load_checkpoint('/pretrained_models/tictacshoot/pytorch/', 'best.pth.tar')
+    checkpoint = ('/pretrained_models/tictacshoot/pytorch/', 'best.pth.tar')
 else: # Keras
-    n1.load_checkpoint('./pretrained_models/tictacshoot/keras/', 'best.h5')
+    checkpoint = ('./pretrained_models/tictacshoot/keras/', 'best.h5')
+n1.load_checkpoint(*checkpoint)
 
 # MCTS arguments
-args1 = dotdict({'numMCTSSims': 50, 'cpuct': 1.0})
+args1 = dotdict({'numMCTSSims': 50, 'cpuct': 1.0, 'mctsCycleDetection': True})
 # Create the MCTS agent
-mcts1 = MCTS(g, n1, args1)
+if NUM_WORKERS > 1:
+    mcts1 = ParallelMCTS(g, n1, args1, NUM_WORKERS, checkpoint=checkpoint)
+else:
+    mcts1 = MCTS(g, n1, args1)
 # Define the AI player function (takes the best action)
 n1p = lambda x: np.argmax(mcts1.getActionProb(x, temp=0))
 
@@ -65,7 +72,7 @@ else:
 # The Arena will pit player n1p against player2
 # The game's display function is used to print the board
 # FIXED: Use instance method g.display instead of class method Game.display
-arena = Arena.Arena(n1p, player2, g, display=g.display)
+arena = Arena.Arena(n1p, player2, g, display=g.display, repetitionLimit=3)
 
 # Play 2 games and print the results
 print(arena.playGames(2, verbose=True))
\ No newline at end of file
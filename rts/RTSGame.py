@@ -6,6 +6,7 @@ import numpy as np
 from rts.src.config_class import CONFIG
 
 sys.path.append('..')
+from Game import Game
 from rts.src.Board import Board
 from rts.src.config import NUM_ENCODERS, NUM_ACTS, P_NAME_IDX, A_TYPE_IDX, TIME_IDX, FPS
 
@@ -20,7 +21,7 @@ Includes:
 
 
 # noinspection PyPep8Naming,PyMethodMayBeStatic
-class RTSGame:
+class RTSGame(Game):
 
     def __init__(self) -> None:
         self.n = CONFIG.grid_size
@@ -5,6 +5,7 @@ import numpy as np
 
 sys.path.append('../..')
 from NeuralNet import NeuralNet
+from ReplayBuffer import toArrays
 from rts.keras.RTSNNet import RTSNNet
 from rts.src.config import VERBOSE_MODEL_FIT
 
@@ -43,10 +44,7 @@ class NNetWrapper(NeuralNet):
         """
         from rts.src.config_class import CONFIG
 
-        input_boards, target_pis, target_vs = list(zip(*examples))
-        input_boards = np.asarray(input_boards)
-        target_pis = np.asarray(target_pis)
-        target_vs = np.asarray(target_vs)
+        input_boards, target_pis, target_vs = toArrays(examples)
 
         """
         input_boards = CONFIG.nnet_args.encoder.encode_multiple(input_boards)
@@ -72,6 +70,16 @@ class NNetWrapper(NeuralNet):
         pi, v = self.nnet.model.predict(board, verbose=False)
         return pi[0], v[0]
 
+    def predict_batch(self, boards):
+        """
+        Predicts the actions of several boards in one forward pass, see predict.
+        :param boards: list of specific boards
+        :return: predicted actions and win predictions of every board (Pis, Vs)
+        """
+        boards = np.array([self.encoder.encode(board) for board in boards])
+        pi, v = self.nnet.model.predict(boards, verbose=False)
+        return pi, v
+
     def save_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar'):
         # change extension
         filename = filename.split(".")[0] + ".h5"
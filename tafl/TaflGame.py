@@ -54,6 +54,13 @@ class TaflGame(Game):
             valids[x1+y1*self.n+x2*self.n**2+y2*self.n**3]=1
         return np.array(valids)
 
+    def getValidActions(self, board, player):
+        # the legal moves of a Hnefatafl position are a few dozen out of n**4 actions
+        legalMoves = board.getCopy().get_legal_moves(board.getPlayerToMove())
+        if len(legalMoves) == 0:
+            return np.array([self.getActionSize() - 1])
+        return np.unique([x1+y1*self.n+x2*self.n**2+y2*self.n**3 for x1, y1, x2, y2 in legalMoves])
+
     def getGameEnded(self, board, player):
         # return 0 if not ended, if player 1 won, -1 if player 1 lost
         return board.done*player
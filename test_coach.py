@@ -0,0 +1,253 @@
+"""
+
+    Tests for the self-play drivers of Coach. The games are searched with the deterministic stand-in for the neural
+    network of test_mcts.py, so no ML framework needs to be installed.
+"""
+
+import os
+import pickle
+import tempfile
+import unittest
+
+import numpy as np
+
+from Arena import Arena
+from AsyncCoach import AsyncCoach, readBestVersion
+from Coach import Coach
+from ExampleStore import ExampleStore, ShardDataset
+from Game import Game
+from utils import *
+
+from test_mcts import HashNet, NoShootNet, SpinGame
+from tictactoe.TicTacToeGame import TicTacToeGame
+
+
+class BrokenCheckpointNet(HashNet):
+    """HashNet whose checkpoints can't be loaded, the self-play and gating processes die at their start."""
+
+    def load_checkpoint(self, folder, filename):
+        raise OSError(f'Can not load {filename}')
+
+
+class WinOnRepeatGame(Game):
+    """Two positions played in turn by a single action, player 1 wins when the first one comes back."""
+
+    def getInitBoard(self):
+        return np.array([0, 0])  # position, #moves played
+
+    def getActionSize(self):
+        return 1
+
+    def getNextState(self, board, player, action):
+        return np.array([1 - board[0], board[1] + 1]), -player
+
+    def getValidMoves(self, board, player):
+        return np.ones(1)
+
+    def getGameEnded(self, board, player):
+        return player if board[1] == 2 else 0
+
+    def getCanonicalForm(self, board, player):
+        return board
+
+    def getRepetitionKey(self, board):
+        return board[:1].tobytes()
+
+
+class TestCoach(unittest.TestCase):
+
+    @staticmethod
+    def args(**kwargs):
+        return dotdict(dict({'numMCTSSims': 10, 'cpuct': 1.0, 'tempThreshold': 5, 'numEps': 6}, **kwargs))
+
+    def assertExamples(self, game, examples):
+        self.assertGreater(len(examples), 0)
+        for board, pi, v in examples:
+            self.assertEqual(np.shape(board), game.getBoardSize())
+            self.assertEqual(len(pi), game.getActionSize())
+            self.assertAlmostEqual(sum(pi), 1.0)
+            self.assertIn(v, (-1, 1, 1e-4, -1e-4))
+
+    def test_execute_episode(self):
+        game = TicTacToeGame()
+        coach = Coach(game, HashNet(game), self.args())
+        self.assertExamples(game, coach.executeEpisode())
+
+    def test_playout_cap(self):
+        game = TicTacToeGame()
+        coach = Coach(game, HashNet(game), self.args(playoutCapFraction=0, numMCTSSimsFast=3))
+        self.assertEqual(coach.executeEpisode(), [])
+        self.assertEqual(coach.mcts.lastSearch['sims'], 3)
+
+        np.random.seed(0)
+        coach = Coach(game, HashNet(game), self.args(playoutCapFraction=0.5, numMCTSSimsFast=3))
+        lengths = {len(coach.executeEpisode()) for _ in range(10)}
+        self.assertGreater(len(lengths), 1)
+        self.assertTrue(all(n % 8 == 0 for n in lengths))
+
+    def test_resignation(self):
+        game = TicTacToeGame()
+        # every root value is below 1, player 1 resigns at its second move
+        coach = Coach(game, HashNet(game), self.args(resignThreshold=1, resignMoves=2, noResignFraction=0))
+        examples = coach.executeEpisode()
+        self.assertEqual(len(examples), 3 * 8)
+        self.assertEqual([v for _, _, v in examples[::8]], [-1, 1, -1])
+        self.assertEqual(coach.resignStats['resigned'], 1)
+
+        coach = Coach(game, HashNet(game), self.args(resignThreshold=1, resignMoves=2, noResignFraction=1))
+        for _ in range(3):
+            self.assertGreater(len(coach.executeEpisode()), 3 * 8)
+        self.assertEqual(coach.resignStats['checked'], 3)
+        self.assertGreater(coach.resignStats['pliesAfterResign'], 0)
+        with self.assertLogs('Coach', level='INFO'):
+            coach.logResignStats()
+        self.assertEqual(coach.resignStats['checked'], 0)
+
+    def test_parallel_games(self):
+        game = TicTacToeGame()
+        for extra in ({}, {'mctsNodeTable': True, 'mctsBatchSize': 2}):
+            nnet = HashNet(game)
+            coach = Coach(game, nnet, self.args(numParallelGames=4, **extra))
+            examples = coach.executeEpisodes(6)
+            self.assertExamples(game, examples)
+            # a draw or a win ends every game, 8 symmetries are recorded per move
+            self.assertGreaterEqual(len(examples), 6 * 5 * 8)
+            self.assertLess(nnet.batches, nnet.calls)
+
+    def test_self_play_workers(self):
+        game = TicTacToeGame()
+        with tempfile.TemporaryDirectory() as folder:
+            coach = Coach(game, HashNet(game), self.args(numSelfPlayWorkers=2, checkpoint=folder))
+            examples = coach.executeEpisodesInPool(6)
+        self.assertExamples(game, examples)
+        self.assertIsNone(coach.pnet)
+        self.assertGreaterEqual(len(examples), 6 * 5 * 8)
+
+    def test_async_pipeline(self):
+        game = TicTacToeGame()
+        with tempfile.TemporaryDirectory() as folder:
+            args = self.args(numIters=2, numEps=3, arenaCompare=2, updateThreshold=0.6, maxlenOfQueue=1000,
+                             numItersForTrainExamplesHistory=20, numSelfPlayWorkers=2, checkpoint=folder)
+            coach = AsyncCoach(game, HashNet(game), args)
+            with self.assertLogs('AsyncCoach', level='INFO') as logs:
+                coach.learn()
+            self.assertIn(readBestVersion(folder), (0, 1, 2))
+            self.assertEqual(len(ExampleStore(os.path.join(folder, 'examples'))), len(coach.replayBuffer))
+        self.assertEqual(coach.replayBuffer.getIterations(), [1, 2])
+        self.assertExamples(game, coach.replayBuffer)
+        # the last candidate is always gated before learn returns
+        self.assertTrue(any('VERSION 2' in line for line in logs.output))
+
+    def test_async_pipeline_resume(self):
+        game = TicTacToeGame()
+        with tempfile.TemporaryDirectory() as folder:
+            args = self.args(numIters=1, numEps=3, arenaCompare=2, updateThreshold=0, maxlenOfQueue=1000,
+                             numItersForTrainExamplesHistory=20, numSelfPlayWorkers=1, checkpoint=folder)
+            AsyncCoach(game, HashNet(game), args).learn()
+            self.assertEqual(readBestVersion(folder), 1)
+            coach = AsyncCoach(game, HashNet(game), args)
+            with self.assertLogs('AsyncCoach', level='INFO') as logs:
+                coach.learn()
+            # the second run starts from the best network and numbers its iterations after it
+            self.assertEqual(readBestVersion(folder), 2)
+            self.assertEqual(coach.replayBuffer.getIterations(), [2])
+        self.assertTrue(any('Resuming from the best version 1' in line for line in logs.output))
+
+    def test_async_pipeline_dead_worker(self):
+        game = TicTacToeGame()
+        with tempfile.TemporaryDirectory() as folder:
+            args = self.args(numIters=1, numEps=3, arenaCompare=2, updateThreshold=0.6, maxlenOfQueue=1000,
+                             numItersForTrainExamplesHistory=20, numSelfPlayWorkers=1, checkpoint=folder)
+            with self.assertRaises(RuntimeError):
+                AsyncCoach(game, BrokenCheckpointNet(game), args).learn()
+
+    def test_train_examples_shards(self):
+        game = TicTacToeGame()
+        with tempfile.TemporaryDirectory() as folder:
+            args = self.args(checkpoint=folder, load_folder_file=(folder, Coach.getCheckpointFile(0)),
+                             numItersForTrainExamplesHistory=2)
+            coach = Coach(game, HashNet(game), args)
+            for i in range(1, 4):
+                coach.replayBuffer.add(coach.executeEpisode(), i)
+                coach.saveTrainExamples(i)
+            store = ExampleStore(os.path.join(folder, 'examples'))
+            # every iteration is written once, the oldest shard is deleted
+            self.assertEqual(store.getShards(), [1, 2])
+            self.assertEqual(len([name for name in os.listdir(store.folder) if name.endswith('.npy')]), 2 * 3)
+            boards, pis, vs = store.load(2)
+            self.assertIsInstance(boards, np.memmap)
+            np.testing.assert_array_equal(vs, coach.replayBuffer.getIteration(3)[2])
+
+            loaded = Coach(game, HashNet(game), args)
+            loaded.loadTrainExamples()
+            self.assertTrue(loaded.skipFirstSelfPlay)
+            self.assertEqual(len(loaded.replayBuffer.getIterations()), 2)
+            self.assertEqual(len(loaded.replayBuffer), len(store))
+
+            # shards written after a resume do not overwrite the older ones
+            loaded.replayBuffer.add(loaded.executeEpisode(), 2)
+            loaded.saveTrainExamples(2)
+            self.assertEqual(ExampleStore(store.folder).getShards(), [2, 3])
+
+        with tempfile.TemporaryDirectory() as folder:
+            # a trainExamplesHistory pickled by older versions
+            args = self.args(checkpoint=folder, load_folder_file=(folder, Coach.getCheckpointFile(0)))
+            history = [coach.executeEpisode(), coach.executeEpisode()]
+            with open(os.path.join(folder, Coach.getCheckpointFile(0) + '.examples'), 'wb') as f:
+                pickle.dump(history, f)
+            loaded = Coach(game, HashNet(game), args)
+            loaded.loadTrainExamples()
+            self.assertEqual(len(loaded.replayBuffer), sum(map(len, history)))
+            self.assertEqual(len(loaded.replayBuffer.getIterations()), 2)
+
+    def test_stream_train_examples(self):
+        game = TicTacToeGame()
+        with tempfile.TemporaryDirectory() as folder:
+            args = self.args(checkpoint=folder, load_folder_file=(folder, Coach.getCheckpointFile(0)),
+                             numItersForTrainExamplesHistory=2, streamTrainExamples=True)
+            coach = Coach(game, HashNet(game), args)
+            for i in range(1, 4):
+                coach.replayBuffer.add(coach.executeEpisode(), i)
+                coach.saveTrainExamples(i)
+            dataset = coach.getTrainExamples()
+            self.assertIsInstance(dataset, ShardDataset)
+            self.assertEqual(len(dataset), len(ExampleStore(os.path.join(folder, 'examples'))))
+            self.assertEqual(len(coach.replayBuffer), 0)
+            self.assertExamples(game, list(zip(*dataset.sample(16))))
+
+            loaded = Coach(game, HashNet(game), args)
+            loaded.loadTrainExamples()
+            self.assertTrue(loaded.skipFirstSelfPlay)
+            self.assertEqual(len(loaded.replayBuffer), 0)
+
+        with tempfile.TemporaryDirectory() as folder:
+            coach = Coach(game, HashNet(game), self.args(checkpoint=folder, streamTrainExamples=True))
+            with self.assertRaises(RuntimeError):
+                coach.getTrainExamples()
+
+    def test_repetition_draw(self):
+        game = SpinGame()
+        spin = lambda board: game.ACTION_SPIN if game._decode_board(board).actions_left == 2 else game.ACTION_END_TURN
+        # every turn spins the pieces once, the first position comes back after 8 turns
+        self.assertEqual(Arena(spin, spin, game, repetitionLimit=2).playGame(), 1e-4)
+
+        moves = []
+        counted = lambda board: moves.append(board) or spin(board)
+        Arena(counted, counted, game, repetitionLimit=3).playGame()
+        # the first position occurs a third time after two rounds of 8 turns of two moves
+        self.assertEqual(len(moves), 2 * 8 * 2)
+
+        # a winning move that repeats a position still wins
+        game = WinOnRepeatGame()
+        self.assertEqual(Arena(lambda board: 0, lambda board: 0, game, repetitionLimit=2).playGame(), 1)
+
+        game = SpinGame()
+        coach = Coach(game, NoShootNet(game), self.args(repetitionLimit=2, tempThreshold=0))
+        examples = coach.executeEpisode()
+        self.assertGreater(len(examples), 0)
+        self.assertTrue(all(abs(v) == 1e-4 for _, _, v in examples))
+        self.assertLess(len(examples), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,465 @@
+"""
+
+    Tests for the MCTS variants. The searches are driven by a deterministic stand-in for the neural network, so the
+    statistics of the different tree layouts can be compared with each other without any ML framework installed.
+"""
+
+import unittest
+import zlib
+
+import numpy as np
+
+from EvalCache import EvalCache
+from MCTS import MCTS, ignoredOptions
+from NeuralNet import NeuralNet
+from NodeMCTS import NodeMCTS
+from ParallelMCTS import ParallelMCTS
+from utils import *
+
+from othello.OthelloGame import OthelloGame
+from tafl.TaflGame import TaflGame
+from tictactoe.TicTacToeGame import TicTacToeGame
+from tictacshoot.CustomTicTacToeGame import CustomTicTacToeGame
+from tictacshoot.CustomTicTacToeLogic import Board
+
+
+class HashNet(NeuralNet):
+    """Returns a fixed pseudo-random policy and value for every board."""
+
+    def __init__(self, game):
+        self.action_size = game.getActionSize()
+        self.calls = 0
+        self.batches = 0
+
+    def predict(self, board):
+        self.calls += 1
+        rng = np.random.RandomState(zlib.crc32(np.ascontiguousarray(board).tobytes()))
+        pi = rng.dirichlet(np.ones(self.action_size))
+        return pi, rng.uniform(-1, 1)
+
+    def predict_batch(self, boards):
+        self.batches += 1
+        return super().predict_batch(boards)
+
+
+class SpinGame(CustomTicTacToeGame):
+    """tictacshoot from a full board where nobody has won, only SPIN, SHOOT and END_TURN are left."""
+
+    def getInitBoard(self):
+        b = Board(self.n)
+        b.pieces = np.array([[1, -1, 1], [1, -1, -1], [-1, 1, 1]])
+        b.token_active = False
+        return self._encode_board(b)
+
+
+class NoShootNet(HashNet):
+    """HashNet that never suggests SHOOT, so searches of SpinGame keep spinning the pieces around."""
+
+    def predict(self, board):
+        pi, _ = super().predict(board)
+        pi[self.action_size - 2] = 0  # ACTION_SHOOT
+        return pi / pi.sum(), 0.
+
+
+def play_moves(game, mcts, moves, temp=1):
+    """Plays `moves` moves with the most visited action and returns every policy."""
+    board, player = game.getInitBoard(), 1
+    policies = []
+    for _ in range(moves):
+        if game.getGameEnded(board, player) != 0:
+            break
+        canonicalBoard = game.getCanonicalForm(board, player)
+        pi = mcts.getActionProb(canonicalBoard, temp=temp)
+        policies.append(np.asarray(pi, dtype=np.float64))
+        board, player = game.getNextState(board, player, int(np.argmax(pi)))
+    return policies
+
+
+class TestMCTS(unittest.TestCase):
+
+    @staticmethod
+    def args(**kwargs):
+        return dotdict(dict({'numMCTSSims': 30, 'cpuct': 1.0}, **kwargs))
+
+    def assertSameSearch(self, game, moves, **kwargs):
+        reference = play_moves(game, MCTS(game, HashNet(game), self.args()), moves)
+        other = play_moves(game, MCTS(game, HashNet(game), self.args(**kwargs)), moves)
+        self.assertEqual(len(reference), len(other))
+        for p, q in zip(reference, other):
+            np.testing.assert_allclose(p, q)
+
+    def test_node_table_selected_from_args(self):
+        game = OthelloGame(4)
+        self.assertIsInstance(MCTS(game, HashNet(game), self.args(mctsNodeTable=True)), NodeMCTS)
+        self.assertNotIsInstance(MCTS(game, HashNet(game), self.args()), NodeMCTS)
+
+    def test_node_table_othello(self):
+        self.assertSameSearch(OthelloGame(4), 8, mctsNodeTable=True)
+
+    def test_node_table_tictacshoot(self):
+        self.assertSameSearch(CustomTicTacToeGame(), 8, mctsNodeTable=True)
+
+    def test_node_table_options(self):
+        game = OthelloGame(4)
+        ignoredOptions.clear()
+        with self.assertLogs('MCTS', level='WARNING') as logs:
+            MCTS(game, HashNet(game), self.args(mctsBatchSize=4, mctsSolver=True))
+            MCTS(game, HashNet(game), self.args(mctsBatchSize=4))
+        self.assertEqual(len(logs.output), 2)  # once per option
+        with self.assertNoLogs('MCTS', level='WARNING'):
+            MCTS(game, HashNet(game), self.args(mctsBatchSize=4, mctsCompactNodes=True, mctsNodeTable=True))
+
+    def test_compact_nodes(self):
+        self.assertSameSearch(OthelloGame(4), 8, mctsNodeTable=True, mctsCompactNodes=True)
+
+        game = OthelloGame(6)
+        sizes = []
+        for extra in ({}, {'mctsNodeTable': True}, {'mctsNodeTable': True, 'mctsCompactNodes': True}):
+            mcts = MCTS(game, HashNet(game), self.args(**extra))
+            play_moves(game, mcts, 6)
+            sizes.append(mcts.getTreeSize())
+        self.assertEqual(len({size['expanded'] for size in sizes}), 1)
+        self.assertGreater(sizes[0]['bytes'], sizes[1]['bytes'])
+        self.assertGreater(sizes[1]['bytes'], sizes[2]['bytes'])
+
+    def test_sparse_nodes(self):
+        game = OthelloGame(6)
+        mcts = MCTS(game, HashNet(game), self.args())
+        board = game.getInitBoard()
+        pi = mcts.getActionProb(board)
+        s = game.stringRepresentation(board)
+        np.testing.assert_array_equal(mcts.Vs[s], np.flatnonzero(game.getValidMoves(board, 1)))
+        self.assertEqual(len(mcts.Ps[s]), len(mcts.Vs[s]))
+        self.assertEqual(len(pi), game.getActionSize())
+        self.assertAlmostEqual(sum(pi[a] for a in mcts.Vs[s]), 1.0)
+
+        game = TaflGame("Brandubh")
+        board, player = game.getInitBoard(), 1
+        for _ in range(4):
+            actions = game.getValidActions(board, player)
+            np.testing.assert_array_equal(actions, np.flatnonzero(game.getValidMoves(board, player)))
+            board, player = game.getNextState(board, player, int(actions[len(actions) // 2]))
+
+    def test_iterative_search(self):
+        self.assertSameSearch(CustomTicTacToeGame(), 8, mctsIterative=True)
+        self.assertSameSearch(OthelloGame(4), 8, mctsIterative=True)
+
+    def test_iterative_search_node_table(self):
+        self.assertSameSearch(CustomTicTacToeGame(), 8, mctsIterative=True, mctsNodeTable=True)
+        self.assertSameSearch(OthelloGame(4), 8, mctsIterative=True, mctsNodeTable=True)
+
+    def check_node_budget(self, **kwargs):
+        game = CustomTicTacToeGame()
+        mcts = MCTS(game, HashNet(game), self.args(numMCTSSims=200, mctsMaxNodes=50, **kwargs))
+        board = game.getInitBoard()
+        pi = mcts.getActionProb(board)
+
+        size = mcts.getTreeSize()
+        self.assertLessEqual(size['nodes'], 50)
+        self.assertGreater(size['bytes'], 0)
+        self.assertIn(game.stringRepresentation(board), mcts.Es)
+        self.assertAlmostEqual(sum(pi), 1.0)
+
+    def test_node_budget(self):
+        for policy in ('lru', 'visits'):
+            self.check_node_budget(mctsEvictionPolicy=policy)
+            self.check_node_budget(mctsEvictionPolicy=policy, mctsNodeTable=True, mctsBatchSize=4)
+
+    def test_transition_cache(self):
+        for game in (CustomTicTacToeGame(), OthelloGame(4)):
+            self.assertSameSearch(game, 8, mctsTransitionCache=1000)
+            self.assertSameSearch(game, 8, mctsTransitionCache=1000, mctsNodeTable=True, mctsIterative=True)
+
+        game = CustomTicTacToeGame()
+        mcts = MCTS(game, HashNet(game), self.args(mctsTransitionCache=10))
+        mcts.getActionProb(game.getInitBoard())
+        self.assertEqual(len(mcts.Bs), 10)
+
+    def test_forced_moves(self):
+        game = CustomTicTacToeGame()
+        for extra in ({}, {'mctsNodeTable': True}, {'mctsNodeTable': True, 'mctsBatchSize': 4}):
+            nnet = HashNet(game)
+            mcts = MCTS(game, nnet, self.args(numMCTSSims=200, mctsForcedMoves=True, **extra))
+            board = game.getInitBoard()
+            self.assertAlmostEqual(sum(mcts.getActionProb(board)), 1.0)
+            self.assertGreater(mcts.forcedNodes, 0)
+            self.assertEqual(mcts.getTreeSize()['expanded'], nnet.calls + mcts.forcedNodes)
+
+        # placing a piece and spinning twice leaves END_TURN as the only move
+        board, player = game.getInitBoard(), 1
+        for action in (0, game.ACTION_SPIN, game.ACTION_SPIN):
+            board, player = game.getNextState(board, player, action)
+        nnet = HashNet(game)
+        mcts = MCTS(game, nnet, self.args(mctsSkipForcedRoot=True))
+        pi = mcts.getActionProb(game.getCanonicalForm(board, player))
+        self.assertEqual(int(np.argmax(pi)), game.ACTION_END_TURN)
+        self.assertEqual(nnet.calls, 0)
+        self.assertEqual(mcts.skippedSims, self.args().numMCTSSims)
+
+    def test_solver(self):
+        game = TicTacToeGame()
+        # X to move can win with action 2 and must otherwise block it next turn
+        board = np.array([[1, 1, 0], [-1, -1, 0], [0, 0, 0]])
+        for extra in ({}, {'mctsBatchSize': 4}):
+            nnet = HashNet(game)
+            mcts = MCTS(game, nnet, self.args(numMCTSSims=400, mctsNodeTable=True, mctsSolver=True, **extra))
+            pi = mcts.getActionProb(board, temp=1)
+            self.assertEqual(pi[2], 1)
+            root = mcts.nodes[game.stringRepresentation(board)]
+            self.assertEqual(root.solved, 1)
+            self.assertLess(root.n, 399)
+
+        # O to move faces two threats, every move is proven to lose
+        board = np.array([[-1, -1, 0], [-1, 1, 0], [0, 0, 1]])
+        mcts = MCTS(game, HashNet(game), self.args(numMCTSSims=400, mctsNodeTable=True, mctsSolver=True))
+        pi = mcts.getActionProb(board, temp=1)
+        root = mcts.nodes[game.stringRepresentation(board)]
+        self.assertEqual(root.solved, -1)
+        self.assertEqual(sum(pi), 1)
+        self.assertLess(root.n, 399)
+
+    def test_batched_leaf_evaluation(self):
+        game = CustomTicTacToeGame()
+        nnet = HashNet(game)
+        mcts = MCTS(game, nnet, self.args(numMCTSSims=65, mctsNodeTable=True, mctsBatchSize=8))
+        board = game.getInitBoard()
+        pi = mcts.getActionProb(board, temp=1)
+
+        counts = mcts.getVisitCounts(game.stringRepresentation(board))
+        self.assertEqual(counts.sum(), 64)  # the first simulation expands the root
+        self.assertEqual(nnet.batches, 8)
+        self.assertAlmostEqual(sum(pi), 1.0)
+        for node in mcts.nodes.values():
+            self.assertIsNone(node.VL)
+
+    def test_stopping_rules(self):
+        game = CustomTicTacToeGame()
+        board = game.getInitBoard()
+        for extra in ({}, {'mctsNodeTable': True}, {'mctsNodeTable': True, 'mctsBatchSize': 4}):
+            mcts = MCTS(game, HashNet(game), self.args(**extra))
+            mcts.getActionProb(board)
+            self.assertEqual(mcts.lastSearch['sims'], 30)
+            self.assertEqual(mcts.lastSearch['stop'], 'sims')
+
+            mcts = MCTS(game, HashNet(game), self.args(numMCTSSims=10 ** 6, mctsTimeBudget=0.05, **extra))
+            pi = mcts.getActionProb(board)
+            self.assertEqual(mcts.lastSearch['stop'], 'time')
+            self.assertLess(mcts.lastSearch['sims'], 10 ** 6)
+            self.assertLess(mcts.lastSearch['seconds'], 1.0)
+            self.assertAlmostEqual(sum(pi), 1.0)
+
+            mcts = MCTS(game, HashNet(game), self.args(numMCTSSims=400, mctsEarlyStop=True, **extra))
+            mcts.getActionProb(board)
+            counts = np.sort(mcts.getVisitCounts(game.stringRepresentation(board)))
+            self.assertEqual(mcts.lastSearch['stop'], 'early')
+            self.assertGreater(counts[-1] - counts[-2], 400 - mcts.lastSearch['sims'])
+
+    def test_search_stats(self):
+        game = OthelloGame(4)
+        self.assertIsNone(MCTS(game, HashNet(game), self.args()).getStats())
+        for extra in ({}, {'mctsIterative': True}, {'mctsNodeTable': True},
+                      {'mctsNodeTable': True, 'mctsBatchSize': 4}):
+            nnet = HashNet(game)
+            mcts = MCTS(game, nnet, self.args(mctsStats=True, mctsTransitionCache=1000, **extra))
+            play_moves(game, mcts, 6)
+            stats = mcts.getStats(reset=True)
+
+            self.assertEqual(stats['searches'], 6)
+            self.assertEqual(stats['nodes'], mcts.getTreeSize()['expanded'])
+            if 'mctsBatchSize' in extra:
+                self.assertLess(stats['nnetCalls'], nnet.calls)
+            else:
+                self.assertEqual(stats['nnetCalls'], nnet.calls)
+            self.assertGreater(stats['cacheHits'], 0)
+            self.assertGreaterEqual(stats['maxDepth'], stats['meanDepth'])
+            self.assertGreater(stats['meanDepth'], 1)
+            for phase in ('selection', 'inference', 'getNextState', 'getValidActions', 'getGameEnded',
+                          'stringRepresentation'):
+                self.assertGreater(stats['calls'][phase], 0, phase)
+                self.assertGreaterEqual(stats['time'][phase], 0, phase)
+            self.assertEqual(mcts.getStats()['sims'], 0)
+
+            # the timers keep counting after a reset
+            calls = nnet.calls
+            play_moves(game, mcts, 2)
+            stats = mcts.getStats()
+            if 'mctsBatchSize' not in extra:
+                self.assertEqual(stats['nnetCalls'], nnet.calls - calls)
+            self.assertGreater(stats['nnetCalls'], 0)
+            self.assertGreater(stats['calls']['selection'], 0)
+            self.assertGreater(stats['time']['getNextState'], 0)
+
+    def test_eval_cache(self):
+        game = OthelloGame(4)
+        reference = play_moves(game, MCTS(game, HashNet(game), self.args()), 6)
+        for extra in ({}, {'mctsNodeTable': True}, {'mctsNodeTable': True, 'mctsBatchSize': 4}):
+            cache = EvalCache(1000)
+            nnet = HashNet(game)
+            play_moves(game, MCTS(game, nnet, self.args(**extra), cache), 6)
+            calls = nnet.calls
+            second = play_moves(game, MCTS(game, nnet, self.args(**extra), cache), 6)
+            self.assertEqual(nnet.calls, calls)  # the second game only hits the cache
+            self.assertGreater(cache.getStats()['hitRate'], 0)
+            if not extra:
+                for p, q in zip(reference, second):
+                    np.testing.assert_allclose(p, q)
+
+            cache.invalidate()
+            play_moves(game, MCTS(game, nnet, self.args(**extra), cache), 1)
+            self.assertGreater(nnet.calls, calls)
+
+        cache = EvalCache(10)
+        play_moves(game, MCTS(game, HashNet(game), self.args(), cache), 2)
+        self.assertEqual(len(cache), 10)
+
+    def test_progressive_widening(self):
+        results = []
+        for extra in ({}, {'mctsNodeTable': True}, {'mctsNodeTable': True, 'mctsIterative': True}):
+            game = OthelloGame(6)
+            results.append(play_moves(game, MCTS(game, HashNet(game), self.args(mctsWidening=0.5, **extra)), 8))
+
+            # only the children of the root with the highest priors are visited
+            game = TicTacToeGame()
+            board = game.getInitBoard()
+            mcts = MCTS(game, HashNet(game), self.args(numMCTSSims=50, mctsWidening=0.5, **extra))
+            mcts.getActionProb(board)
+            counts = np.array(mcts.getVisitCounts(game.stringRepresentation(board)))
+            visited = np.flatnonzero(counts)
+            self.assertEqual(len(visited), mcts.getWidth(counts.sum() - 1))
+            pi, _ = HashNet(game).predict(board)
+            others = np.setdiff1d(game.getValidActions(board, 1), visited)
+            self.assertGreaterEqual(pi[visited].min(), pi[others].max())
+
+        for policies in results[1:]:
+            for p, q in zip(results[0], policies):
+                np.testing.assert_allclose(p, q)
+
+    def test_symmetry(self):
+        game = TicTacToeGame()
+        board = game.getInitBoard()
+        for extra in ({}, {'mctsNodeTable': True}):
+            plain, symm = HashNet(game), HashNet(game)
+            mcts = MCTS(game, plain, self.args(numMCTSSims=100, **extra))
+            mcts.getActionProb(board)
+            symmMcts = MCTS(game, symm, self.args(numMCTSSims=100, mctsSymmetry=True, **extra))
+            symmMcts.getActionProb(board)
+            self.assertLess(symm.calls, plain.calls)
+            self.assertLess(symmMcts.getTreeSize()['nodes'], mcts.getTreeSize()['nodes'])
+
+        # the search from any orientation of a board is the same, up to the symmetry
+        board = np.array([[1, 0, 0], [0, -1, 0], [0, 1, 0]])  # a board without symmetries of its own
+        mcts = MCTS(game, HashNet(game), self.args(mctsSymmetry=True))
+        pi = mcts.getActionProb(board)
+        valids = game.getValidMoves(board, 1)
+        self.assertAlmostEqual(sum(pi), 1.0)
+        self.assertEqual(np.dot(pi, 1 - valids), 0)
+        for symmBoard, symmPi in game.getSymmetries(board, pi):
+            mcts = MCTS(game, HashNet(game), self.args(mctsSymmetry=True))
+            np.testing.assert_allclose(mcts.getActionProb(symmBoard), symmPi)
+
+    def test_root_noise(self):
+        game = OthelloGame(6)
+        board = game.getInitBoard()
+        s = game.stringRepresentation(board)
+        for extra in ({}, {'mctsNodeTable': True}):
+            mcts = MCTS(game, HashNet(game), self.args(mctsDirichletEpsilon=0.25, **extra))
+            mcts.getActionProb(board)
+            Ps = mcts.nodes[s].P if extra else mcts.Ps[s]
+            pi, _ = HashNet(game).predict(board)
+            prior = pi[game.getValidActions(board, 1)]
+            self.assertAlmostEqual(Ps.sum(), 1.0)
+            self.assertFalse(np.allclose(Ps, prior / prior.sum()))
+
+            # the noise is only mixed in once per root
+            Ps = np.array(Ps)
+            mcts.getActionProb(board)
+            np.testing.assert_array_equal(mcts.nodes[s].P if extra else mcts.Ps[s], Ps)
+
+    def test_root_parallel(self):
+        game = CustomTicTacToeGame()
+        mcts = ParallelMCTS(game, HashNet(game), self.args(), 2)
+        try:
+            policies = play_moves(game, mcts, 3)
+            self.assertEqual(len(policies), 3)
+            for pi in policies:
+                self.assertAlmostEqual(sum(pi), 1.0)
+            self.assertEqual(mcts.lastSearch['sims'], 2 * self.args().numMCTSSims)
+        finally:
+            mcts.close()
+
+        # without noise every worker runs the same search, the summed counts give the policy of one search
+        args = self.args(mctsDirichletEpsilon=0)
+        mcts = ParallelMCTS(game, HashNet(game), args, 2)
+        try:
+            board = game.getInitBoard()
+            single = MCTS(game, HashNet(game), args)
+            np.testing.assert_allclose(mcts.getActionProb(board, temp=2), single.getActionProb(board, temp=2))
+        finally:
+            mcts.close()
+
+    def test_root_counts(self):
+        game = TicTacToeGame()
+        board = np.array([[1, 0, 0], [0, -1, 0], [0, 1, 0]])
+        for extra in ({}, {'mctsSymmetry': True}, {'mctsNodeTable': True, 'mctsSymmetry': True}):
+            mcts = MCTS(game, HashNet(game), self.args(**extra))
+            pi = mcts.getActionProb(board)
+            counts = mcts.getRootCounts(board)
+            self.assertEqual(counts.sum(), self.args().numMCTSSims - 1)
+            np.testing.assert_allclose(pi, counts / counts.sum())
+
+    def test_cycle_detection(self):
+        game = SpinGame()
+        board = game.getInitBoard()
+        later = np.array(board)
+        later[5] = 42  # the same position at another turn
+        self.assertNotEqual(game.stringRepresentation(board), game.stringRepresentation(later))
+        self.assertEqual(game.getRepetitionKey(board), game.getRepetitionKey(later))
+
+        for extra in ({}, {'mctsIterative': True}, {'mctsNodeTable': True},
+                      {'mctsNodeTable': True, 'mctsBatchSize': 4}, {'mctsNodeTable': True, 'mctsSolver': True}):
+            plain = MCTS(game, NoShootNet(game), self.args(numMCTSSims=200, mctsStats=True, **extra))
+            plain.getActionProb(board)
+            mcts = MCTS(game, NoShootNet(game), self.args(numMCTSSims=200, mctsStats=True,
+                                                          mctsCycleDetection=True, **extra))
+            pi = mcts.getActionProb(board)
+            self.assertAlmostEqual(sum(pi), 1.0)
+            stats = mcts.getStats()
+            self.assertEqual(mcts.lastSearch['sims'], 200)
+            self.assertGreater(stats['cycleHits'], 0)
+            self.assertEqual(plain.getStats()['cycleHits'], 0)
+            # 8 spins bring the pieces back, no simulation walks further around
+            self.assertLessEqual(stats['maxDepth'], 2 * 8 + 2)
+            if 'mctsBatchSize' not in extra:  # virtual losses drive the plain batched search to SHOOT
+                self.assertLess(mcts.getTreeSize()['nodes'], plain.getTreeSize()['nodes'])
+
+    def check_tree_reuse(self, **kwargs):
+        game = OthelloGame(4)
+        mcts = MCTS(game, HashNet(game), self.args(mctsReuseTree=True, **kwargs))
+        board = game.getInitBoard()
+        pi = mcts.getActionProb(board)
+        size = len(mcts.Es)
+
+        nextBoard, player = game.getNextState(board, 1, int(np.argmax(pi)))
+        nextBoard = game.getCanonicalForm(nextBoard, player)
+        s = game.stringRepresentation(nextBoard)
+        kept = np.array(mcts.getVisitCounts(s))
+        self.assertGreater(kept.sum(), 0)
+
+        self.assertGreater(mcts.advanceRoot(nextBoard), 0)
+        self.assertLess(len(mcts.Es), size)
+        np.testing.assert_array_equal(mcts.getVisitCounts(s), kept)
+
+        # a new game starts from a board that is no longer in the tree
+        play_moves(game, mcts, 20)
+        mcts.getActionProb(board)
+        self.assertLessEqual(len(mcts.Es), self.args().numMCTSSims + 1)
+
+    def test_tree_reuse(self):
+        self.check_tree_reuse()
+
+    def test_tree_reuse_node_table(self):
+        self.check_tree_reuse(mctsNodeTable=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+"""
+
+    Tests for the ring buffer of training examples and their shards on disk.
+"""
+
+import pickle
+import tempfile
+import unittest
+
+import numpy as np
+
+from ExampleStore import ExampleStore, ShardDataset
+from ReplayBuffer import ReplayBuffer, fitExamples, sampleBatch, toArrays
+
+
+def make_examples(n, first=0):
+    """Examples whose board, policy and value all hold their number."""
+    return [(np.full((3, 3), i), np.full(4, i / 4), float(i)) for i in range(first, first + n)]
+
+
+class TestReplayBuffer(unittest.TestCase):
+
+    def test_add_and_read(self):
+        buffer = ReplayBuffer(100)
+        buffer.add(make_examples(5), 1)
+        buffer.add(make_examples(3, 5), 2)
+        self.assertEqual(len(buffer), 8)
+        self.assertEqual(buffer.getIterations(), [1, 2])
+        self.assertEqual([v for _, _, v in buffer], list(range(8)))
+        board, pi, v = buffer[-1]
+        np.testing.assert_array_equal(board, np.full((3, 3), 7))
+        self.assertEqual(v, 7)
+        with self.assertRaises(IndexError):
+            buffer[8]
+
+    def test_overwrites_oldest(self):
+        buffer = ReplayBuffer(10)
+        buffer.add(make_examples(4), 1)
+        with self.assertLogs('ReplayBuffer', level='WARNING') as logs:
+            buffer.add(make_examples(8, 4), 2)
+        self.assertEqual(len(logs.output), 1)
+        self.assertEqual(len(buffer), 10)
+        self.assertEqual(buffer.getIterations(), [1, 2])
+        boards, pis, vs = buffer.toArrays()
+        np.testing.assert_array_equal(vs, np.arange(2, 12))
+        np.testing.assert_array_equal(boards[:, 0, 0], np.arange(2, 12))
+
+        buffer.dropOldestIteration()
+        self.assertEqual(buffer.getIterations(), [2])
+        np.testing.assert_array_equal(buffer.toArrays()[2], np.arange(4, 12))
+        buffer.add(make_examples(3, 12), 3)
+        np.testing.assert_array_equal(buffer.toArrays()[2], np.arange(5, 15))
+
+    def test_grows(self):
+        buffer = ReplayBuffer(5000)
+        buffer.add(make_examples(3000), 1)
+        self.assertEqual(len(buffer), 3000)
+        self.assertLessEqual(len(buffer.vs), 5000)
+        np.testing.assert_array_equal(buffer.toArrays()[2], np.arange(3000))
+
+    def test_sample(self):
+        buffer = ReplayBuffer(10)
+        buffer.add(make_examples(15), 1)
+        boards, pis, vs = sampleBatch(buffer, 64)
+        self.assertEqual(boards.shape, (64, 3, 3))
+        self.assertEqual(pis.shape, (64, 4))
+        self.assertTrue(np.all(vs >= 5))
+        np.testing.assert_array_equal(boards[:, 1, 1], vs)
+        np.testing.assert_allclose(pis[:, 0], vs / 4)
+
+        # lists of examples are still accepted
+        boards, pis, vs = sampleBatch(make_examples(5), 8)
+        self.assertEqual(len(boards), 8)
+        self.assertEqual(toArrays(make_examples(5))[0].shape, (5, 3, 3))
+
+    def test_pickle(self):
+        buffer = ReplayBuffer(10)
+        buffer.add(make_examples(12), 1)
+        copy = pickle.loads(pickle.dumps(buffer))
+        self.assertEqual(copy.getIterations(), [1])
+        np.testing.assert_array_equal(copy.toArrays()[2], buffer.toArrays()[2])
+
+
+class FitRecorder():
+    """Stands in for a Keras model, records the arguments of fit."""
+
+    def fit(self, x=None, y=None, **kwargs):
+        self.x, self.y, self.kwargs = x, y, kwargs
+
+
+class TestShardDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.store = ExampleStore(self.folder.name)
+        for first, n in ((0, 5), (5, 20), (25, 7)):
+            boards, pis, vs = toArrays(make_examples(n, first))
+            self.store.write(boards, pis, vs)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def assertBatch(self, batch, n):
+        boards, pis, vs = batch
+        self.assertEqual(boards.shape, (n, 3, 3))
+        self.assertEqual(pis.shape, (n, 4))
+        np.testing.assert_array_equal(boards[:, 2, 2], vs)
+        np.testing.assert_allclose(pis[:, 3], vs / 4)
+
+    def test_sample(self):
+        dataset = ShardDataset(self.store)
+        self.assertEqual(len(dataset), 32)
+        batch = sampleBatch(dataset, 500)
+        self.assertBatch(batch, 500)
+        # every shard is sampled
+        self.assertEqual(set(batch[2].astype(int)), set(range(32)))
+        np.testing.assert_array_equal(dataset.toArrays()[2], np.arange(32))
+
+        dataset = ShardDataset(self.store, shards=self.store.getShards()[1:])
+        self.assertEqual(len(dataset), 27)
+        self.assertTrue(np.all(dataset.sample(100)[2] >= 5))
+
+        with self.assertRaises(ValueError):
+            ShardDataset(self.store, shards=[]).sample(8)
+
+    def test_prefetch(self):
+        dataset = ShardDataset(self.store, prefetch=2)
+        try:
+            for _ in range(5):
+                self.assertBatch(dataset.sample(16), 16)
+            self.assertBatch(dataset.sample(8), 8)
+            self.assertTrue(dataset.thread.is_alive())
+        finally:
+            dataset.close()
+        self.assertIsNone(dataset.thread)
+
+    def test_prefetch_failure(self):
+        dataset = ShardDataset(self.store, prefetch=2)
+        dataset.sample(4)
+        thread = dataset.thread
+        dataset.arrays = []  # every draw now fails
+        with self.assertRaises(RuntimeError):
+            for _ in range(5):
+                dataset.sample(4)
+        self.assertIsNone(dataset.thread)
+        self.assertFalse(thread.is_alive())
+
+    def test_fit(self):
+        model = FitRecorder()
+        fitExamples(model, ShardDataset(self.store), 8, 2)
+        self.assertIsNone(model.y)
+        self.assertEqual(model.kwargs, {'steps_per_epoch': 4, 'epochs': 2})
+        boards, (pis, vs) = next(model.x)
+        self.assertBatch((boards, pis, vs), 8)
+
+        fitExamples(model, make_examples(10), 8, 2)
+        self.assertEqual(model.x.shape, (10, 3, 3))
+        self.assertEqual(model.kwargs, {'batch_size': 8, 'epochs': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
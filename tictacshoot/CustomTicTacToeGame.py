@@ -89,6 +89,11 @@ class CustomTicTacToeGame(Game):
     def stringRepresentation(self, board):
         return board.tobytes()
 
+    def getRepetitionKey(self, board):
+        # Same as stringRepresentation without the turn_number plane, which
+        # differs for every recurrence of a position (SPIN cycles rotations).
+        return np.delete(board, 5, axis=0).tobytes()
+
     def display(self, board):
         b = self._decode_board(board)
         n = b.n